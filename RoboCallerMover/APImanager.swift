@@ -141,6 +141,53 @@ class APIManager {
             }
         }.resume()
     }
+
+    // MARK: - Moving Query Events
+    // Streams inquiry changes for a moving query from the server's
+    // /moving_queries/{id}/events server-sent events endpoint.
+    // The stream ends when the connection drops or the consuming task is cancelled.
+    func inquiryEvents(movingQueryID: Int) -> AsyncThrowingStream<InquiryEvent, Error> {
+        AsyncThrowingStream { continuation in
+            let task = Task {
+                do {
+                    guard let url = URL(string: "http://127.0.0.1:8000/moving_queries/\(movingQueryID)/events") else {
+                        throw NSError(domain: "", code: -1, userInfo: [NSLocalizedDescriptionKey : "Invalid URL"])
+                    }
+
+                    var urlRequest = URLRequest(url: url)
+                    urlRequest.setValue("text/event-stream", forHTTPHeaderField: "Accept")
+                    urlRequest.timeoutInterval = 60
+
+                    let (bytes, response) = try await URLSession.shared.bytes(for: urlRequest)
+                    if let httpResponse = response as? HTTPURLResponse, !(200...299).contains(httpResponse.statusCode) {
+                        let msg = "Server returned status code: \(httpResponse.statusCode)"
+                        throw NSError(domain: "", code: httpResponse.statusCode, userInfo: [NSLocalizedDescriptionKey : msg])
+                    }
+
+                    // Every event is a single "data:" line; comments and event names are skipped
+                    for try await line in bytes.lines {
+                        guard line.hasPrefix("data:") else { continue }
+                        let payload = line.dropFirst("data:".count).trimmingCharacters(in: .whitespaces)
+                        if let event = try? JSONDecoder().decode(InquiryEvent.self, from: Data(payload.utf8)) {
+                            continuation.yield(event)
+                        }
+                    }
+                    continuation.finish()
+                } catch {
+                    continuation.finish(throwing: error)
+                }
+            }
+            continuation.onTermination = { _ in task.cancel() }
+        }
+    }
+}
+
+// MARK: - Event Structs
+
+// Only the ids are decoded; the changed columns are re-read from the inquiry table
+struct InquiryEvent: Codable {
+    let id: Int
+    let moving_query_id: Int
 }
 
 // MARK: - Request Structs
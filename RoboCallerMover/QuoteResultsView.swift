@@ -46,14 +46,11 @@ struct QuoteResultsView: View {
             .padding()
             .navigationTitle("Move from \(fromLocation) to \(toLocation)")
             .navigationBarTitleDisplayMode(.inline)
-            .onAppear {
-                // Start data fetch and realtime subscription
-                Task{
-                    fetchMovingCompanies()
-                    await fetchMovingInquiries()
-                    await subscribeToRealtimeUpdates()
-                }
-
+            .task {
+                // Start data fetch and realtime subscription; cancelled when the view goes away
+                fetchMovingCompanies()
+                await fetchMovingInquiries()
+                await subscribeToRealtimeUpdates()
             }
             .onDisappear {
                 // Cleanup if needed
@@ -243,10 +240,23 @@ struct QuoteResultsView: View {
         }
     }
 
-    // MARK: - Subscribe to Realtime Updates (Callback‑Based)
-    private func subscribeToRealtimeUpdates() {
-        Timer.scheduledTimer(withTimeInterval: 5.0, repeats: true) { _ in
-            Task {
+    // MARK: - Subscribe to Realtime Updates (Server-Sent Events)
+    // Inquiries are re-read only when the server reports a change to one of ours,
+    // instead of on a timer. Reconnects after a short pause if the stream drops.
+    private func subscribeToRealtimeUpdates() async {
+        while !Task.isCancelled {
+            do {
+                for try await event in APIManager.shared.inquiryEvents(movingQueryID: movingQueryID) {
+                    if movingInquiryIDS.contains(event.id) {
+                        await fetchMovingInquiries()
+                    }
+                }
+            } catch {
+                print("Inquiry event stream dropped: \(error.localizedDescription)")
+            }
+            // A reconnect can miss events, so catch up once before listening again
+            try? await Task.sleep(nanoseconds: 2_000_000_000)
+            if !Task.isCancelled {
                 await fetchMovingInquiries()
             }
         }
@@ -38,8 +38,8 @@ struct CompanyView: View {
         }
         .navigationTitle(company?.name ?? "Company Details")
         .navigationBarTitleDisplayMode(.inline)
-        .onAppear {
-            subscribeToRealtimeUpdates()
+        .task {
+            await subscribeToRealtimeUpdates()
         }
     }
 
@@ -221,9 +221,20 @@ struct CompanyView: View {
         }
     }
 
-    private func subscribeToRealtimeUpdates() {
-        Timer.scheduledTimer(withTimeInterval: 5.0, repeats: true) { _ in
-            Task {
+    // Re-reads the inquiry when the server streams a change to it, instead of polling.
+    // Reconnects after a short pause if the stream drops.
+    private func subscribeToRealtimeUpdates() async {
+        await updateInquiry()
+        while !Task.isCancelled {
+            do {
+                for try await event in APIManager.shared.inquiryEvents(movingQueryID: movingQueryID) where event.id == movingInquiryID {
+                    await updateInquiry()
+                }
+            } catch {
+                print("Inquiry event stream dropped: \(error.localizedDescription)")
+            }
+            try? await Task.sleep(nanoseconds: 2_000_000_000)
+            if !Task.isCancelled {
                 await updateInquiry()
             }
         }
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from app.telemetry.logs import fields
+
+logger = logging.getLogger(__name__)
+
+# How long a SQLiteCache waits for another process's write lock before giving up; the
+# lookup then counts as a miss and the write is skipped
+CACHE_BUSY_TIMEOUT = float(os.getenv("CACHE_BUSY_TIMEOUT", "1"))
+
+# Returned by the caches on a miss, so that None can be cached as a negative result
+MISSING = object()
+
+
+# Rough deep size of a cached value: containers plus everything they hold
+def deep_sizeof(value) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_sizeof(item) for item in value)
+    return size
+
+
+# In-process LRU cache with a TTL per entry
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._loading = {}  # key -> task of the load in flight
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # ttl overrides the default lifetime, e.g. when promoting an entry from the disk tier
+    def set(self, key, value, ttl: float = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # Read-through lookup: on a miss, awaits loader() and caches what it returns. Concurrent
+    # misses for a key share one load (single-flight). Results for which cache_if(result)
+    # is false are returned but not cached. The load runs in its own task, so a caller
+    # cancelled while waiting (a client disconnect) doesn't cancel it for the others.
+    async def get_or_load(self, key, loader, ttl: float = None, cache_if=None):
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        load = self._loading.get(key)
+        if load is not None:
+            self.coalesced += 1
+        else:
+            load = asyncio.ensure_future(self._load(key, loader, ttl, cache_if))
+            # Waiters re-raise a failure; don't warn when every one of them has gone
+            load.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._loading[key] = load
+            self.loads += 1
+        return await asyncio.shield(load)
+
+    async def _load(self, key, loader, ttl: float, cache_if):
+        try:
+            value = await loader()
+        finally:
+            # An invalidate() during the load has already dropped this task
+            current = self._loading.get(key) is asyncio.current_task()
+            if current:
+                del self._loading[key]
+        if current and (cache_if is None or cache_if(value)):
+            self.set(key, value, ttl=ttl)
+        return value
+
+    # Also makes a load in flight for the key skip caching its (now stale) result
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._loading.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def memory_bytes(self) -> int:
+        return sum(deep_sizeof(key) + deep_sizeof(value) for key, (_, value) in self._entries.items())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            # Lookups answered without a load of their own, counting coalesced misses
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+# On-disk key/value table with a TTL per entry; values are stored as JSON. The methods
+# block, so code on the event loop goes through TieredCache.aget/aset, which call them in
+# a thread. A table that stays locked (or any other SQLite error) makes a lookup a miss
+# and a write a no-op rather than failing the request.
+class SQLiteCache:
+    def __init__(self, path: str, table: str, busy_timeout: float = CACHE_BUSY_TIMEOUT):
+        self.path = path
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        # Shared by every worker process; a writer waits briefly for another's lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _failed(self, operation: str, error: sqlite3.Error):
+        self.errors += 1
+        logger.warning("disk cache unavailable", extra=fields(table=self.table, operation=operation, error=repr(error)))
+
+    # Returns (value, remaining ttl) or (MISSING, 0)
+    def get(self, key):
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] <= now:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    row = None
+        except sqlite3.Error as e:
+            self._failed("read", e)
+            row = None
+        if row is None:
+            self.misses += 1
+            return MISSING, 0
+        self.hits += 1
+        return json.loads(row[0]), row[1] - now
+
+    def set(self, key, value, ttl: float):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time() + ttl),
+                )
+        except sqlite3.Error as e:
+            self._failed("write", e)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    # Entries are otherwise only deleted when their key is read after they expire
+    def purge_expired(self) -> int:
+        try:
+            with self._lock:
+                return self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),)).rowcount
+        except sqlite3.Error as e:
+            self._failed("purge", e)
+            return 0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"path": self.path, "size": len(self), "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+# Two-tier cache: the in-process LRU is checked first, then the SQLite table.
+# Disk hits are promoted into memory with whatever lifetime they have left.
+class TieredCache:
+    def __init__(self, memory: TTLCache, disk: SQLiteCache, ttl: float, negative_ttl: float = None):
+        self.memory = memory
+        self.disk = disk
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        value, remaining = self.disk.get(key)
+        if value is not MISSING:
+            self.memory.set(key, value, ttl=remaining)
+        return value
+
+    # None is cached as a negative result with the shorter negative_ttl
+    def set(self, key, value, ttl: float = None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        self.memory.set(key, value, ttl=ttl)
+        self.disk.set(key, value, ttl)
+
+    # get and set for the event loop: the disk tier is read and written in a thread, so a
+    # write lock held by another process never stalls the loop
+    async def aget(self, key):
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        value, remaining = await asyncio.to_thread(self.disk.get, key)
+        if value is not MISSING:
+            self.memory.set(key, value, ttl=remaining)
+        return value
+
+    async def aset(self, key, value, ttl: float = None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        self.memory.set(key, value, ttl=ttl)
+        await asyncio.to_thread(self.disk.set, key, value, ttl)
+
+    def invalidate(self, key):
+        self.memory.invalidate(key)
+        self.disk.invalidate(key)
+
+    def stats(self) -> dict:
+        hits = self.memory.hits + self.disk.hits
+        lookups = self.memory.hits + self.memory.misses
+        return {
+            "hits": hits,
+            "misses": self.disk.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats(),
+        }
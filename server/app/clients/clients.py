@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import httpx
+from dotenv import load_dotenv
+from app.telemetry.logs import fields
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# One pooled async HTTP client per upstream, opened in the app lifespan and closed at
+# shutdown. Every outbound request goes through these, so TLS connections are reused
+# across requests and each upstream gets limits and timeouts that suit it:
+#
+#   response = await clients.get("google").get(url, params=...)
+#
+# A client asked for outside the lifespan (benchmarks, the job worker process) is opened
+# on first use.
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+# Opens connections to each upstream at startup (see prewarm)
+HTTP_PREWARM = os.getenv("HTTP_PREWARM", "1") == "1"
+
+# name -> httpx.AsyncClient options. HTTP/2 is negotiated where the server offers it and
+# multiplexes concurrent requests over one connection.
+POOLS = {
+    # Geocoding, Places search and Details
+    "google": {
+        "http2": True,
+        "timeout": httpx.Timeout(10.0, connect=5.0, pool=5.0),
+        "limits": httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE, keepalive_expiry=60.0),
+    },
+    "vapi": {
+        "http2": True,
+        "timeout": httpx.Timeout(15.0, connect=5.0, pool=5.0),
+        "limits": httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE, keepalive_expiry=60.0),
+    },
+    # Completions can take a while to come back
+    "openai": {
+        "http2": True,
+        "timeout": httpx.Timeout(60.0, connect=5.0, pool=5.0),
+        "limits": httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=60.0),
+    },
+    # PostgREST queries; the Supabase storage backend adds its base URL and headers
+    "supabase": {
+        "http2": True,
+        "follow_redirects": True,
+        "timeout": httpx.Timeout(10.0, connect=5.0, pool=5.0),
+        "limits": httpx.Limits(
+            max_connections=int(os.getenv("SUPABASE_POOL_SIZE", "20")),
+            max_keepalive_connections=int(os.getenv("SUPABASE_POOL_SIZE", "20")),
+            keepalive_expiry=30.0,
+        ),
+    },
+}
+
+
+class HTTPClients:
+    def __init__(self, pools: dict):
+        self.pools = pools
+        self.clients = {}
+        self.loops = {}  # name -> event loop the client's connections belong to
+        self.counters = {name: {"requests": 0, "connections_opened": 0, "tls_handshakes": 0} for name in pools}
+
+    # httpcore reports each new TCP connection and TLS handshake; requests that trigger
+    # neither went out on a pooled connection
+    def _event_hooks(self, name: str) -> dict:
+        counters = self.counters[name]
+
+        async def trace(event_name: str, info: dict):
+            if event_name == "connection.connect_tcp.complete":
+                counters["connections_opened"] += 1
+            elif event_name == "connection.start_tls.complete":
+                counters["tls_handshakes"] += 1
+
+        async def on_request(request: httpx.Request):
+            counters["requests"] += 1
+            request.extensions["trace"] = trace
+
+        return {"request": [on_request]}
+
+    # Opens the named client with its pool settings; options (base_url, headers, ...)
+    # are passed through to httpx. A client whose connections belong to another event
+    # loop (a script's asyncio.run that has finished) is replaced rather than reused.
+    def open(self, name: str, **options) -> httpx.AsyncClient:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        client = self.clients.get(name)
+        owner = self.loops.get(name)
+        if client is not None and not client.is_closed and (owner is None or owner is loop):
+            return client
+        client = httpx.AsyncClient(**{**self.pools[name], **options, "event_hooks": self._event_hooks(name)})
+        self.clients[name] = client
+        self.loops[name] = loop
+        return client
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        return self.open(name)
+
+    def start(self):
+        for name in self.pools:
+            if name != "supabase":
+                self.open(name)
+
+    async def close(self):
+        clients, self.clients, self.loops = list(self.clients.values()), {}, {}
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+    # Opens a connection to each url's host ahead of the first real request (DNS, TCP,
+    # TLS). One request per host; failures are only logged.
+    async def prewarm(self, urls: dict, timeout: float = 5.0):
+        async def warm(name, origin):
+            try:
+                await self.get(name).head(origin, timeout=timeout)
+            except httpx.HTTPError as e:
+                logger.warning("could not prewarm connection", extra=fields(pool=name, origin=origin, error=repr(e)))
+
+        origins = {
+            (name, str(httpx.URL(url).copy_with(path="/", query=None)))
+            for name, pool_urls in urls.items() for url in pool_urls
+        }
+        await asyncio.gather(*(warm(name, origin) for name, origin in origins))
+
+    # Connection and queue counts come from httpcore's pool, which httpx doesn't expose
+    # (httpcore is pinned to 1.x in requirements.txt). Whatever a future httpcore no longer
+    # has is left out of the stats instead of breaking /stats.
+    def _pool_stats(self, client: httpx.AsyncClient) -> dict:
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is None:
+            return {}
+        stats = {}
+        try:
+            connections = list(pool.connections)
+            stats["open_connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for connection in connections if connection.is_idle())
+            stats["http2_connections"] = sum(1 for connection in connections if "HTTP/2" in connection.info())
+        except (AttributeError, TypeError):
+            pass
+        try:
+            requests = list(pool._requests)
+            queued = sum(1 for request in requests if request.is_queued())
+            stats["active_requests"] = len(requests) - queued
+            stats["queued_requests"] = queued
+        except (AttributeError, TypeError):
+            pass
+        return stats
+
+    def stats(self) -> dict:
+        stats = {}
+        for name, counters in self.counters.items():
+            client = self.clients.get(name)
+            requests = counters["requests"]
+            stats[name] = {
+                "open": client is not None and not client.is_closed,
+                "max_connections": self.pools[name]["limits"].max_connections,
+                **counters,
+                "reuse_ratio": 1 - counters["connections_opened"] / requests if requests else 0.0,
+                **(self._pool_stats(client) if client is not None and not client.is_closed else {}),
+            }
+        return stats
+
+
+clients = HTTPClients(POOLS)
@@ -1,45 +1,99 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import models
-from app.schemas import schemas
+from app.models.models import to_dict
+
+# Async CRUD functions behind the SQLAlchemy storage backend.
+# They mirror the Supabase queries in app/database/supabase_storage.py.
 
-# CRUD functions for MovingQuery
-def get_moving_query(db: Session, query_id: int):
-    return db.query(models.MovingQuery).filter(models.MovingQuery.id == query_id).first()
 
-def get_moving_queries(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.MovingQuery).offset(skip).limit(limit).all()
+def _insert(db: AsyncSession, table):
+    if db.bind.dialect.name == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
 
-def create_moving_query(db: Session, moving_query: schemas.MovingQueryCreate):
-    db_moving_query = models.MovingQuery(**moving_query.dict())
+# CRUD functions for MovingQuery
+async def create_moving_query(db: AsyncSession, moving_query_data: dict) -> dict:
+    db_moving_query = models.MovingQuery(**moving_query_data)
     db.add(db_moving_query)
-    db.commit()
-    db.refresh(db_moving_query)
-    return db_moving_query
+    await db.commit()
+    return to_dict(db_moving_query)
+
+async def get_moving_query(db: AsyncSession, moving_query_id: int) -> list:
+    result = await db.execute(select(models.MovingQuery).where(models.MovingQuery.id == moving_query_id))
+    return [to_dict(row) for row in result.scalars()]
 
 # CRUD functions for MovingCompany
-def get_moving_company(db: Session, company_id: int):
-    return db.query(models.MovingCompany).filter(models.MovingCompany.id == company_id).first()
-
-def get_moving_companies(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.MovingCompany).offset(skip).limit(limit).all()
-
-def create_moving_company(db: Session, moving_company: schemas.MovingCompanyCreate):
-    db_moving_company = models.MovingCompany(**moving_company.dict())
-    db.add(db_moving_company)
-    db.commit()
-    db.refresh(db_moving_company)
-    return db_moving_company
-
-# CRUD functions for PhoneCalls
-def get_phone_call(db: Session, call_id: int):
-    return db.query(models.PhoneCalls).filter(models.PhoneCalls.id == call_id).first()
-
-def get_phone_calls(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.PhoneCalls).offset(skip).limit(limit).all()
-
-def create_phone_call(db: Session, phone_call: schemas.PhoneCallCreate):
-    db_phone_call = models.PhoneCalls(**phone_call.dict())
-    db.add(db_phone_call)
-    db.commit()
-    db.refresh(db_phone_call)
-    return db_phone_call
+async def upsert_moving_companies(db: AsyncSession, rows: list) -> dict:
+    statement = _insert(db, models.MovingCompany).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[models.MovingCompany.phone_number],
+        set_={column: statement.excluded[column] for column in rows[0] if column != "phone_number"},
+    ).returning(models.MovingCompany.phone_number, models.MovingCompany.id)
+    result = await db.execute(statement)
+    company_ids = dict(result.all())
+    await db.commit()
+    return company_ids
+
+async def list_moving_companies(db: AsyncSession) -> list:
+    result = await db.execute(select(models.MovingCompany).order_by(models.MovingCompany.id))
+    return [to_dict(row) for row in result.scalars()]
+
+# CRUD functions for MovingInquiry
+async def create_inquiries(db: AsyncSession, rows: list) -> list:
+    result = await db.execute(_insert(db, models.MovingInquiry).values(rows).returning(models.MovingInquiry.id))
+    inquiry_ids = list(result.scalars())
+    await db.commit()
+    return inquiry_ids
+
+async def get_inquiries(db: AsyncSession, moving_query_id: int) -> list:
+    result = await db.execute(select(models.MovingInquiry).where(models.MovingInquiry.moving_query_id == moving_query_id))
+    return [to_dict(row) for row in result.scalars()]
+
+async def update_inquiries(db: AsyncSession, values: dict, **filters) -> list:
+    statement = update(models.MovingInquiry).values(values).returning(models.MovingInquiry)
+    for column, value in filters.items():
+        statement = statement.where(getattr(models.MovingInquiry, column) == value)
+    result = await db.execute(statement, execution_options={"synchronize_session": False})
+    rows = [to_dict(row) for row in result.scalars()]
+    await db.commit()
+    return rows
+
+# Atomic claim: the WHERE is evaluated under the row's write lock, so of two concurrent
+# claims only one gets each inquiry
+async def claim_inquiries(db: AsyncSession, inquiry_ids: list) -> list:
+    statement = update(models.MovingInquiry).where(
+        models.MovingInquiry.id.in_(inquiry_ids),
+        models.MovingInquiry.vapi_call_id.is_(None),
+        models.MovingInquiry.in_progress.isnot(True),
+    ).values(in_progress=True).returning(models.MovingInquiry)
+    result = await db.execute(statement, execution_options={"synchronize_session": False})
+    rows = [to_dict(row) for row in result.scalars()]
+    await db.commit()
+    return rows
+
+async def release_inquiries(db: AsyncSession, inquiry_ids: list) -> list:
+    statement = update(models.MovingInquiry).where(
+        models.MovingInquiry.id.in_(inquiry_ids),
+        models.MovingInquiry.vapi_call_id.is_(None),
+    ).values(in_progress=False).returning(models.MovingInquiry)
+    result = await db.execute(statement, execution_options={"synchronize_session": False})
+    rows = [to_dict(row) for row in result.scalars()]
+    await db.commit()
+    return rows
+
+# One executemany UPDATE for every (inquiry id, vapi call id) pair; rows that are gone
+# or already have a call id are left alone
+async def update_vapi_ids(db: AsyncSession, calls: list) -> list:
+    inquiry = models.MovingInquiry.__table__
+    statement = update(inquiry).where(
+        inquiry.c.id == bindparam("inquiry_id"),
+        inquiry.c.vapi_call_id.is_(None),
+    ).values(vapi_call_id=bindparam("new_vapi_call_id"))
+    await db.execute(statement, [{"inquiry_id": inquiry_id, "new_vapi_call_id": vapi_call_id} for inquiry_id, vapi_call_id in calls])
+    await db.commit()
+    written = dict(calls)
+    result = await db.execute(select(models.MovingInquiry).where(models.MovingInquiry.id.in_(list(written))))
+    return [to_dict(row) for row in result.scalars() if row.vapi_call_id == written[row.id]]
@@ -1,66 +1,54 @@
-from supabase import create_client, Client
-from app.schemas.schemas import MovingQuery, MovingInquiry, MovingCompany
+import logging
 import os
-from dotenv import load_dotenv
+from app.cache.cache import TTLCache
+from app.database.storage import STORAGE_BACKEND, create_storage
+from app.events.events import bus, InquiryCreated, CallDialed, CallFinished
+from app.schemas.schemas import MovingQuery
+from app.telemetry.logs import fields
+from app.telemetry.metrics import Instrumented
 
-load_dotenv()
-# Initialize Supabase client
-url: str = os.getenv("SUPABASE_URL")
-key: str = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# The storage backend is picked by STORAGE_BACKEND ("supabase" or "sqlalchemy");
+# everything else in the app goes through the functions below. Every storage call is
+# timed under external_request_seconds{dependency=<backend>}.
+storage = Instrumented(create_storage(), STORAGE_BACKEND)
+logger = logging.getLogger(__name__)
 
-def add_moving_query(moving_query: MovingQuery):
+# Moving queries don't change once created, and every call attempt for a query reads it,
+# so reads go through this cache. Writers to the moving_query table must invalidate it.
+MOVING_QUERY_CACHE_SIZE = int(os.getenv("MOVING_QUERY_CACHE_SIZE", "1000"))
+MOVING_QUERY_CACHE_TTL = float(os.getenv("MOVING_QUERY_CACHE_TTL", "3600"))
+moving_query_cache = TTLCache(maxsize=MOVING_QUERY_CACHE_SIZE, ttl=MOVING_QUERY_CACHE_TTL)
+
+
+async def init():
+    await storage.init()
+
+
+async def close():
+    await storage.close()
+
+
+# origin and destination are the geocoded (lat, lng) of location_from / location_to
+async def add_moving_query(moving_query: MovingQuery, origin: tuple = None, destination: tuple = None, trace_id: str = None):
     # Convert the MovingQuery instance to a dictionary
     moving_query_data = moving_query.dict()
-    
-    # Convert datetime to string
-    moving_query_data['created_at'] = moving_query_data['created_at'].isoformat()
-
-    # Insert the data into the Supabase table
-    response = supabase.table("moving_query").insert(moving_query_data).execute()
-    print(response)
-    if response.data:
-        inserted_row = response.data[0]  # Get the first (and only) inserted row
-        return inserted_row.get('id')
-    else:
-        print("Error inserting data:", response.error)
-        raise HTTPException(status_code=500, detail="Error inserting data")
-
-
-def add_moving_inquiry(moving_inquiry: MovingInquiry):
-    # Convert the MovingInquiry instance to a dictionary
-    moving_inquiry_data = moving_inquiry.dict()
-
-    # Insert the data into the Supabase table
-    response = supabase.table("moving_inquiry").insert(moving_inquiry_data).execute()
-
-    if response.status_code != 201:
-        print("Error inserting data:", response.error)
-    else:
-        print("Data inserted successfully:", response.data)
-
-def add_moving_company(moving_company: MovingCompany):
-    # Convert the MovingInquiry instance to a dictionary
-    moving_company_data = moving_company.dict()
-
-    # Insert the data into the Supabase table
-    response = supabase.table("moving_company").insert(moving_company_data).execute()
-
-    if response.data:
-        print("Data inserted successfully:", response.data) 
-    else:
-        print("Error inserting data:", response.error)
-
-def get_or_create_moving_company(company: dict) -> int:
-    phone_number = company["phone_number"]
-
-    # Check if the company exists in the moving_company table
-    existing_company_response = supabase.table("moving_company").select("id").eq("phone_number", phone_number).execute()
-    if existing_company_response.data:
-        company_id = existing_company_response.data[0]["id"]
-    else:
-        # Insert the new company into the moving_company table
-        insert_response = supabase.table("moving_company").insert({
+    if origin is not None:
+        moving_query_data["from_latitude"], moving_query_data["from_longitude"] = origin
+    if destination is not None:
+        moving_query_data["to_latitude"], moving_query_data["to_longitude"] = destination
+    if trace_id is not None:
+        moving_query_data["trace_id"] = trace_id
+    moving_query_id = await storage.insert_moving_query(moving_query_data)
+    moving_query_cache.invalidate(moving_query_id)
+    return moving_query_id
+
+# Resolves every company to its id in one round trip by upserting on phone_number.
+# Returns a phone_number -> id map.
+async def upsert_moving_companies(companies: list) -> dict:
+    # Postgres rejects an upsert that touches the same row twice, so dedupe first
+    rows = {}
+    for company in companies:
+        rows[company["phone_number"]] = {
             "name": company["name"],
             "address": company["address"],
             "rating": company["rating"],
@@ -69,62 +57,92 @@ def get_or_create_moving_company(company: dict) -> int:
             "longitude": company["longitude"],
             "phone_number": company["phone_number"],
             "coverImage": company["cover_image_url"],
-        }).execute()
-        if not insert_response.data:
-            raise HTTPException(status_code=500, detail="Error inserting new moving company")
-        company_id = insert_response.data[0]["id"]
-
-    return company_id
-
-def create_inquiry(moving_query_id: int, phone_number: str, company_id: int):
-    inquiry_data = {
-        "moving_query_id": moving_query_id,
-        "phone_number": phone_number,
-        "moving_company_id": company_id,
-        "price": -1,
-        "phone_call_transcript": "",
-        "in_progress": False
-    }
-
-    response = supabase.table("moving_inquiry").insert(inquiry_data).execute()
-    if not response.data:
-        print("Error inserting data:", response.error)
-    else:
-        print("Data inserted successfully:", response.data)
-
-def update_vapi_id(moving_query_id: str, phone_number: str, id: str):
-    # Update the "id" field of the moving_inquiry table based on moving_query_id and phone_number
-    response = supabase.table("moving_inquiry").update({"vapi_call_id": id}).eq("moving_query_id", moving_query_id).eq("phone_number", phone_number).execute()
-    # response = supabase.table("moving_inquiry").update({"vapi_call_id": id}).eq("moving_query_id", moving_query_id).execute()
-
-    if not response.data:
-        print("Error updating inquiry id:", response.error)
-    else:
-        print("Inquiry id updated successfully:", response.data)
-
-def update_finished_call(vapi_id, phone_number, structured_data_price, summary, transcript, duration_minutes, recording_url):
+        }
+    if not rows:
+        return {}
+    return await storage.upsert_moving_companies(list(rows.values()))
+
+async def list_moving_companies() -> list:
+    return await storage.list_moving_companies()
+
+async def create_inquiry(moving_query_id: int, phone_number: str, company_id: int):
+    return await create_inquiries_bulk(moving_query_id, [(phone_number, company_id)])
+
+# Inserts every inquiry for a moving query in one request and returns the new ids
+async def create_inquiries_bulk(moving_query_id: int, inquiries: list) -> list:
+    rows = [
+        {
+            "moving_query_id": moving_query_id,
+            "phone_number": phone_number,
+            "moving_company_id": company_id,
+            "price": -1,
+            "phone_call_transcript": "",
+            "in_progress": False
+        }
+        for phone_number, company_id in inquiries
+    ]
+    if not rows:
+        return []
+    inquiry_ids = await storage.insert_inquiries(rows)
+    await bus.publish_all([
+        InquiryCreated(inquiry_id, moving_query_id, row["phone_number"], row["moving_company_id"])
+        for inquiry_id, row in zip(inquiry_ids, rows)
+    ])
+    return inquiry_ids
+
+# Marks inquiries as being dialed before any call is placed. Only inquiries with no
+# vapi_call_id that no one else is dialing come back, so two concurrent call_all
+# requests never call the same company.
+async def claim_inquiries(inquiry_ids: list) -> list:
+    if not inquiry_ids:
+        return []
+    return await storage.claim_inquiries(inquiry_ids)
+
+# Hands claimed inquiries whose call wasn't placed back to the next call_all
+async def release_inquiries(inquiry_ids: list) -> list:
+    if not inquiry_ids:
+        return []
+    return await storage.release_inquiries(inquiry_ids)
+
+# Writes the vapi_call_id of many inquiries at once from (inquiry row, vapi_call_id) pairs
+async def update_vapi_ids_bulk(calls: list):
+    if not calls:
+        return []
+    rows = await storage.update_vapi_ids(calls)
+    if not rows:
+        logger.warning("no inquiries matched bulk vapi_call_id update", extra=fields(calls=len(calls)))
+    await bus.publish_all([CallDialed(row["id"], row["moving_query_id"], row["vapi_call_id"]) for row in rows])
+    return rows
+
+async def update_finished_call(vapi_id, phone_number, structured_data_price, summary, transcript, duration_minutes, recording_url):
     # Update the moving_inquiry table with the provided data based on vapi_id
-    response = supabase.table("moving_inquiry").update({
+    rows = await storage.update_inquiries({
         "price": structured_data_price,
         "phone_call_transcript": transcript,
         "summary": summary,
         "call_duration": duration_minutes,
         "recording_url":  recording_url,
-    }).eq("vapi_call_id", vapi_id).eq("phone_number", phone_number).execute()
-
-    if not response.data:
-        print("Error updating finished call")
-    else:
-        print("Finished call updated successfully:", response.data)
-
-def get_moving_query(moving_query_id: int):
-    response = supabase.table("moving_query").select(
-        "location_from", 
-        "location_to", 
-        "created_at", 
-        "items", 
-        "items_details", 
-        "availability", 
-        "user_id"
-    ).eq("id", moving_query_id).execute()
-    return response.data
\ No newline at end of file
+        "in_progress": False,
+    }, vapi_call_id=vapi_id, phone_number=phone_number)
+
+    if not rows:
+        logger.warning("no inquiry matched finished call", extra=fields(vapi_call_id=vapi_id))
+    await bus.publish_all([
+        CallFinished(row["id"], row["moving_query_id"], vapi_id, structured_data_price, summary, transcript, duration_minutes, recording_url)
+        for row in rows
+    ])
+    return rows
+
+# Read-through: concurrent misses for one id share a single SELECT. A query that
+# isn't found is not cached, so it shows up as soon as it is inserted.
+async def get_moving_query(moving_query_id: int):
+    rows = await moving_query_cache.get_or_load(
+        moving_query_id,
+        lambda: storage.get_moving_query(moving_query_id),
+        cache_if=bool,
+    )
+    # Callers get their own copies of the cached rows
+    return [dict(row) for row in rows]
+
+async def get_inquiries(moving_query_id: int):
+    return await storage.get_inquiries(moving_query_id)
@@ -0,0 +1,79 @@
+import os
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Which storage backend app/database/database.py talks to: "supabase" or "sqlalchemy"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+
+
+# The operations every storage backend implements. Rows go in and come out as plain
+# dictionaries keyed by the Supabase column names. A backend missing one of the
+# abstract methods can't be instantiated, so it fails at startup rather than mid-request.
+class Storage(ABC):
+    async def init(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # Returns the id of the new moving_query row
+    @abstractmethod
+    async def insert_moving_query(self, row: dict) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_moving_query(self, moving_query_id: int) -> list:
+        raise NotImplementedError
+
+    # Inserts or updates companies by phone_number; returns a phone_number -> id map
+    @abstractmethod
+    async def upsert_moving_companies(self, rows: list) -> dict:
+        raise NotImplementedError
+
+    # Every company row, for the in-memory spatial index
+    @abstractmethod
+    async def list_moving_companies(self) -> list:
+        raise NotImplementedError
+
+    # Returns the ids of the new moving_inquiry rows
+    @abstractmethod
+    async def insert_inquiries(self, rows: list) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_inquiries(self, moving_query_id: int) -> list:
+        raise NotImplementedError
+
+    # Updates the inquiries matching every column == value filter; returns the updated rows
+    @abstractmethod
+    async def update_inquiries(self, values: dict, **filters) -> list:
+        raise NotImplementedError
+
+    # Sets in_progress on the inquiries with these ids that have no vapi_call_id and
+    # aren't in progress already, in one atomic UPDATE; returns the rows it claimed
+    @abstractmethod
+    async def claim_inquiries(self, inquiry_ids: list) -> list:
+        raise NotImplementedError
+
+    # Clears in_progress on the inquiries with these ids that still have no vapi_call_id
+    @abstractmethod
+    async def release_inquiries(self, inquiry_ids: list) -> list:
+        raise NotImplementedError
+
+    # Sets vapi_call_id on many inquiries at once from (inquiry row, vapi_call_id) pairs.
+    # Only existing inquiries without a call id are updated; returns the updated rows.
+    @abstractmethod
+    async def update_vapi_ids(self, calls: list) -> list:
+        raise NotImplementedError
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    if backend == "supabase":
+        from app.database.supabase_storage import SupabaseStorage
+        return SupabaseStorage()
+    if backend == "sqlalchemy":
+        from app.database.sqlalchemy_storage import SQLAlchemyStorage
+        return SQLAlchemyStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from fastapi import HTTPException
+from postgrest import AsyncPostgrestClient
+from app.clients.clients import clients
+from app.database.storage import Storage
+from app.telemetry.logs import fields
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+# Supabase's REST endpoint; POSTGREST_URL points the backend at any other PostgREST
+# server instead, e.g. a local stand-in for tests
+url: str = os.getenv("SUPABASE_URL")
+key: str = os.getenv("SUPABASE_KEY")
+POSTGREST_URL = os.getenv("POSTGREST_URL") or f"{url}/rest/v1"
+
+# Every column of the rows handed back, the same ones the SQLAlchemy backend returns
+# (app/models/models.py)
+MOVING_QUERY_COLUMNS = (
+    "id",
+    "location_from",
+    "location_to",
+    "created_at",
+    "items",
+    "items_details",
+    "availability",
+    "user_id",
+    "from_latitude",
+    "from_longitude",
+    "to_latitude",
+    "to_longitude",
+    "trace_id",
+)
+INQUIRY_COLUMNS = (
+    "id",
+    "created_at",
+    "moving_query_id",
+    "moving_company_id",
+    "phone_number",
+    "price",
+    "phone_call_transcript",
+    "summary",
+    "call_duration",
+    "recording_url",
+    "in_progress",
+    "vapi_call_id",
+)
+
+
+# Queries go through the app's "supabase" pool (keep-alive HTTP/2, see app/clients/clients.py)
+class PooledPostgrestClient(AsyncPostgrestClient):
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        return clients.open("supabase", base_url=base_url, headers=headers, verify=verify, proxy=proxy)
+
+
+def create_postgrest_client(base_url: str = POSTGREST_URL, api_key: str = key) -> PooledPostgrestClient:
+    headers = {"Accept": "application/json", "Content-Type": "application/json"}
+    if api_key:
+        headers.update({"apikey": api_key, "Authorization": f"Bearer {api_key}"})
+    return PooledPostgrestClient(base_url, headers=headers)
+
+
+class SupabaseStorage(Storage):
+    def __init__(self, client: PooledPostgrestClient = None):
+        self.supabase = client or create_postgrest_client()
+
+    async def close(self):
+        await self.supabase.aclose()
+
+    async def insert_moving_query(self, row: dict) -> int:
+        # Convert datetime to string
+        row = {**row, "created_at": row["created_at"].isoformat()}
+        response = await self.supabase.table("moving_query").insert(row).execute()
+        if not response.data:
+            raise HTTPException(status_code=500, detail="Error inserting data")
+        moving_query_id = response.data[0].get('id')  # Get the first (and only) inserted row
+        logger.debug("moving query inserted", extra=fields(moving_query_id=moving_query_id))
+        return moving_query_id
+
+    async def get_moving_query(self, moving_query_id: int) -> list:
+        response = await self.supabase.table("moving_query").select(*MOVING_QUERY_COLUMNS).eq("id", moving_query_id).execute()
+        return response.data
+
+    async def upsert_moving_companies(self, rows: list) -> dict:
+        response = await self.supabase.table("moving_company").upsert(rows, on_conflict="phone_number").execute()
+        if not response.data:
+            raise HTTPException(status_code=500, detail="Error upserting moving companies")
+        return {row["phone_number"]: row["id"] for row in response.data}
+
+    # PostgREST caps each response (1000 rows by default), so read the table in pages
+    async def list_moving_companies(self, page_size: int = 1000) -> list:
+        rows = []
+        while True:
+            response = await self.supabase.table("moving_company").select("*").order("id").range(
+                len(rows), len(rows) + page_size - 1
+            ).execute()
+            rows.extend(response.data)
+            if len(response.data) < page_size:
+                return rows
+
+    async def insert_inquiries(self, rows: list) -> list:
+        response = await self.supabase.table("moving_inquiry").insert(rows).execute()
+        if not response.data:
+            raise HTTPException(status_code=500, detail="Error inserting moving inquiries")
+        return [row["id"] for row in response.data]
+
+    async def get_inquiries(self, moving_query_id: int) -> list:
+        response = await self.supabase.table("moving_inquiry").select(*INQUIRY_COLUMNS).eq("moving_query_id", moving_query_id).execute()
+        return response.data
+
+    async def update_inquiries(self, values: dict, **filters) -> list:
+        query = self.supabase.table("moving_inquiry").update(values)
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        response = await query.execute()
+        return response.data
+
+    # Postgres re-checks the filters on a row another UPDATE just changed, so of two
+    # concurrent claims only one gets each inquiry
+    async def claim_inquiries(self, inquiry_ids: list) -> list:
+        response = await self.supabase.table("moving_inquiry").update({"in_progress": True}).in_(
+            "id", inquiry_ids
+        ).is_("vapi_call_id", "null").not_.is_("in_progress", "true").execute()
+        return response.data
+
+    async def release_inquiries(self, inquiry_ids: list) -> list:
+        response = await self.supabase.table("moving_inquiry").update({"in_progress": False}).in_(
+            "id", inquiry_ids
+        ).is_("vapi_call_id", "null").execute()
+        return response.data
+
+    # PostgREST can only write a different value per row with an upsert, which would
+    # insert an inquiry that has since been deleted; one filtered UPDATE per inquiry
+    # instead, sent concurrently over the pooled connection
+    async def update_vapi_ids(self, calls: list) -> list:
+        responses = await asyncio.gather(*(
+            self.supabase.table("moving_inquiry").update({"vapi_call_id": vapi_call_id}).eq(
+                "id", inquiry["id"]
+            ).is_("vapi_call_id", "null").execute()
+            for inquiry, vapi_call_id in calls
+        ))
+        return [row for response in responses for row in response.data]
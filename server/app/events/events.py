@@ -0,0 +1,161 @@
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+# In-process pub/sub for call lifecycle events. The database write functions publish
+# what changed; streaming endpoints, metrics and caches subscribe instead of re-reading
+# the inquiry table. Under several worker processes, app.events.relay carries events
+# published in one process to the subscribers of the others.
+
+# What a subscription does when its queue is full: "block" makes the publisher wait
+# (backpressure on the write path), "drop_oldest" discards the oldest queued event
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+
+
+@dataclass(frozen=True)
+class InquiryCreated:
+    inquiry_id: int
+    moving_query_id: int
+    phone_number: str
+    moving_company_id: int
+    at: float = field(default_factory=time.time, compare=False)
+
+    def columns(self) -> dict:
+        return {"phone_number": self.phone_number, "moving_company_id": self.moving_company_id}
+
+
+# A VAPI call was placed and its id written to the inquiry
+@dataclass(frozen=True)
+class CallDialed:
+    inquiry_id: int
+    moving_query_id: int
+    vapi_call_id: str
+    at: float = field(default_factory=time.time, compare=False)
+
+    def columns(self) -> dict:
+        return {"vapi_call_id": self.vapi_call_id}
+
+
+# The end-of-call report was written to the inquiry
+@dataclass(frozen=True)
+class CallFinished:
+    inquiry_id: int
+    moving_query_id: int
+    vapi_call_id: str
+    price: float
+    summary: str
+    transcript: str
+    duration_minutes: float
+    recording_url: str
+    at: float = field(default_factory=time.time, compare=False)
+
+    def columns(self) -> dict:
+        return {
+            "price": self.price,
+            "phone_call_transcript": self.transcript,
+            "summary": self.summary,
+            "call_duration": self.duration_minutes,
+            "recording_url": self.recording_url,
+        }
+
+
+# Discovery stored these companies; every process adds them to its company index
+@dataclass(frozen=True)
+class CompaniesSaved:
+    companies: list
+    at: float = field(default_factory=time.time, compare=False)
+
+
+EVENT_TYPES = {
+    event_type.__name__: event_type for event_type in (InquiryCreated, CallDialed, CallFinished, CompaniesSaved)
+}
+
+
+class Subscription:
+    def __init__(self, bus, event_types: tuple, maxsize: int, where, overflow: str):
+        self.bus = bus
+        self.event_types = event_types
+        self.where = where
+        self.overflow = overflow
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def accepts(self, event) -> bool:
+        return isinstance(event, self.event_types) and (self.where is None or self.where(event))
+
+    async def put(self, event):
+        if self.closed:
+            return
+        if self.overflow == DROP_OLDEST and self.queue.full():
+            self.queue.get_nowait()
+            self.bus.dropped += 1
+        await self.queue.put(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    # Detaches from the bus and drains the queue, which releases any publisher
+    # blocked on this subscription
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.bus._unsubscribe(self)
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class EventBus:
+    def __init__(self):
+        self._subscriptions = set()
+        self.published = defaultdict(int)  # event type name -> count
+        self.dropped = 0
+        self.forward = None  # set by the relay: (event) -> None, for other processes
+
+    # where filters events before they are queued, e.g. to one moving query
+    def subscribe(self, *event_types, maxsize: int = 100, where=None, overflow: str = BLOCK) -> Subscription:
+        subscription = Subscription(self, event_types or (object,), maxsize, where, overflow)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    # Hands the event to every matching subscriber; waits while a blocking subscriber's
+    # queue is full. relayed marks an event that came from another process.
+    async def publish(self, event, relayed: bool = False):
+        self.published[type(event).__name__] += 1
+        if self.forward is not None and not relayed:
+            self.forward(event)
+        for subscription in list(self._subscriptions):
+            if subscription.accepts(event):
+                await subscription.put(event)
+
+    async def publish_all(self, events: list):
+        for event in events:
+            await self.publish(event)
+
+    def stats(self) -> dict:
+        return {
+            "subscriptions": len(self._subscriptions),
+            "queued": sum(subscription.queue.qsize() for subscription in self._subscriptions),
+            "dropped": self.dropped,
+            "published": dict(self.published),
+        }
+
+
+bus = EventBus()
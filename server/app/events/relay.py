@@ -0,0 +1,150 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+from app.events.events import EVENT_TYPES, bus
+from app.telemetry.logs import fields
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Carries bus events between the worker processes of one server. Each process appends
+# the events it publishes to a shared SQLite table and tails the rows the others wrote,
+# republishing them locally, so an SSE stream or the dialer sees every inquiry change
+# whichever worker made it. Disabled (single process) unless EVENT_RELAY_PATH is set;
+# gunicorn.conf.py sets it.
+
+EVENT_RELAY_PATH = os.getenv("EVENT_RELAY_PATH", "")
+EVENT_RELAY_POLL_INTERVAL = float(os.getenv("EVENT_RELAY_POLL_INTERVAL", "0.2"))
+EVENT_RELAY_OUTBOX_SIZE = 10000
+EVENT_RELAY_BATCH_SIZE = 500
+# Rows only need to outlive the slowest tailer
+EVENT_RELAY_RETENTION = 300
+
+_conn = None
+_lock = threading.Lock()
+_pid = None
+_cursor = 0
+_outbox = None
+_tasks = []
+counters = {"sent": 0, "received": 0, "dropped": 0}
+
+
+def _connect(path: str):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pid INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+
+# Called by the bus for every event published in this process; never blocks the publisher
+def forward(event):
+    try:
+        _outbox.put_nowait(event)
+    except asyncio.QueueFull:
+        counters["dropped"] += 1
+
+
+def _write(events: list):
+    now = time.time()
+    rows = [(_pid, type(event).__name__, json.dumps(dataclasses.asdict(event)), now) for event in events]
+    with _lock:
+        _conn.execute("BEGIN IMMEDIATE")
+        try:
+            _conn.executemany("INSERT INTO events (pid, type, payload, created_at) VALUES (?, ?, ?, ?)", rows)
+            _conn.execute("DELETE FROM events WHERE created_at <= ?", (now - EVENT_RELAY_RETENTION,))
+            _conn.execute("COMMIT")
+        except BaseException:
+            _conn.execute("ROLLBACK")
+            raise
+
+
+def _read() -> list:
+    with _lock:
+        return _conn.execute(
+            "SELECT id, type, payload FROM events WHERE id > ? AND pid != ? ORDER BY id LIMIT ?",
+            (_cursor, _pid, EVENT_RELAY_BATCH_SIZE),
+        ).fetchall()
+
+
+async def send():
+    while True:
+        events = [await _outbox.get()]
+        while not _outbox.empty() and len(events) < EVENT_RELAY_BATCH_SIZE:
+            events.append(_outbox.get_nowait())
+        try:
+            await asyncio.to_thread(_write, events)
+            counters["sent"] += len(events)
+        except sqlite3.Error as e:
+            counters["dropped"] += len(events)
+            logger.warning("event relay write failed", extra=fields(error=repr(e), events=len(events)))
+
+
+async def receive():
+    global _cursor
+    while True:
+        rows = await asyncio.to_thread(_read)
+        for row_id, event_type, payload in rows:
+            _cursor = row_id
+            event_class = EVENT_TYPES.get(event_type)
+            if event_class is not None:
+                counters["received"] += 1
+                await bus.publish(event_class(**json.loads(payload)), relayed=True)
+        if len(rows) < EVENT_RELAY_BATCH_SIZE:
+            await asyncio.sleep(EVENT_RELAY_POLL_INTERVAL)
+
+
+def start(path: str = EVENT_RELAY_PATH):
+    global _conn, _pid, _cursor, _outbox, _tasks
+    if not path or _tasks:
+        return
+    _conn = _connect(path)
+    _pid = os.getpid()
+    # Only events published from now on are relayed
+    _cursor = _conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+    _outbox = asyncio.Queue(maxsize=EVENT_RELAY_OUTBOX_SIZE)
+    bus.forward = forward
+    _tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+
+
+async def stop():
+    global _tasks, _conn
+    if not _tasks:
+        return
+    bus.forward = None
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks = []
+    # Whatever was still queued goes out before the connection closes
+    if not _outbox.empty():
+        events = []
+        while not _outbox.empty():
+            events.append(_outbox.get_nowait())
+        _write(events)
+        counters["sent"] += len(events)
+    _conn.close()
+    _conn = None
+
+
+def stats() -> dict:
+    return {
+        "enabled": bool(_tasks),
+        "path": EVENT_RELAY_PATH or None,
+        "outbox": _outbox.qsize() if _outbox is not None else 0,
+        **counters,
+    }
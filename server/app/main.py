@@ -1,11 +1,72 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from app.schemas import schemas
 # from app.crud import crud
-from app.services import services
-from app.database.database import add_moving_query, update_finished_call, get_moving_query
+from app.services import services, webhooks, inquiry_stream, jobs
+from app.utils import GEOCODE_API_URL, geocode_cache, normalize_phone_number
+from app.clients.clients import HTTP_PREWARM, clients
+from app.database import database
+from app.events import relay
+from app.events.events import bus
+from app.telemetry import logs, metrics, tracing
+from app.telemetry.logs import fields
+from app.database.database import (
+    add_moving_query, claim_inquiries, get_moving_query, get_inquiries,
+)
 
+logs.setup()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logs.setup()
+    clients.start()
+    await database.init()
+    warm_up = [services.load_company_index()]
+    if HTTP_PREWARM:
+        warm_up.append(clients.prewarm({
+            "google": [GEOCODE_API_URL, services.PLACES_API_URL],
+            "vapi": [services.VAPI_API_URL],
+            "openai": [services.OPENAI_API_URL],
+        }))
+    await asyncio.gather(*warm_up)
+    relay.start()
+    metrics.start()
+    index_saved_companies = asyncio.create_task(services.index_saved_companies())
+    purge_expired_caches = asyncio.create_task(services.purge_expired_caches())
+    services.dialer.start()
+    webhooks.start()
+    jobs.start()
+    yield
+    await jobs.stop()
+    await webhooks.stop()
+    # The dialer goes first so no queued call is dialed after its inquiry was released
+    await services.dialer.stop()
+    await services.stop_calls()
+    index_saved_companies.cancel()
+    purge_expired_caches.cancel()
+    await asyncio.gather(index_saved_companies, purge_expired_caches, return_exceptions=True)
+    await metrics.stop()
+    await relay.stop()
+    await database.close()
+    await clients.close()
+    tracing.shutdown()
+    logs.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Later hops of a moving query join the trace stored with it; queries created before
+# tracing have none
+def query_trace(moving_query: dict):
+    trace_id = moving_query.get("trace_id")
+    return tracing.SpanContext(trace_id, None) if trace_id else None
 
 # Dependency
 # def get_db():
@@ -16,58 +77,165 @@ app = FastAPI()
 #         db.close()
 
 @app.post("/get_moving_companies/")
-async def get_moving_companies(moving_query: schemas.MovingQuery, background_tasks: BackgroundTasks):
-    moving_query_id = add_moving_query(moving_query=moving_query)
-    background_tasks.add_task(services.get_moving_companies, moving_query, moving_query_id)
+async def get_moving_companies(moving_query: schemas.MovingQuery):
+    # The query's trace starts here; its id is stored so later calls and webhooks join it
+    with tracing.span("moving_query.create") as root:
+        # Both ends are geocoded together and stored with the query; discovery reuses the origin
+        # Google being down or over quota is a 502/503 (GeocodingUnavailable); only an
+        # address it can't find is the caller's error
+        origin, destination = await services.geocode_moving_query(moving_query)
+        if origin is None:
+            raise HTTPException(status_code=400, detail="Invalid location provided")
+        moving_query_id = await add_moving_query(
+            moving_query=moving_query, origin=origin, destination=destination, trace_id=root.trace_id
+        )
+        root.set(moving_query_id=moving_query_id)
+    # Discovery runs on the job workers; GET /moving_queries/{id}/status follows it
+    await jobs.enqueue_discovery(moving_query_id, root)
 
     return {"moving_query_id": moving_query_id}
 
+# Calls one company of a query right away. 404 if the company has no inquiry for the
+# query, 409 if its inquiry is already being called or was called.
 @app.post("/call_moving_companies/")
 async def call_moving_companies(moving_company_number: str, moving_company_id: int, moving_query_id: int):
-    moving_query_data = get_moving_query(moving_query_id)
+    if normalize_phone_number(moving_company_number) is None:
+        raise HTTPException(status_code=422, detail="Invalid moving company phone number")
+    moving_query_data = await get_moving_query(moving_query_id)
     if isinstance(moving_query_data, list) and len(moving_query_data) > 0:
         moving_query_data = moving_query_data[0]
     else:
         raise HTTPException(status_code=404, detail="Moving query not found")
 
-    print(moving_query_data)
-
-    items_details = moving_query_data["items_details"]
-    availability = moving_query_data["availability"]
-    location_from = moving_query_data["location_from"]
-    location_to = moving_query_data["location_to"]
-
-    return await services.create_phone_call(
-        moving_query_id=moving_query_id,
-        moving_company_id=moving_company_id,
-        moving_company_number=moving_company_number,
-        items=items_details,
-        availability=availability,
-        from_location=location_from,
-        to_location=location_to
+    logger.debug("calling moving company", extra=fields(moving_query_id=moving_query_id, moving_company_id=moving_company_id))
+
+    with tracing.child_span("calls.place", parent=query_trace(moving_query_data), moving_query_id=moving_query_id):
+        vapi_call_id = await services.create_phone_call(moving_query_data, moving_company_number)
+    return {"message": "List of phone calls", "vapi_call_id": vapi_call_id}
+# Calls every moving company of a query: the query is loaded once, its inquiries are
+# claimed and the VAPI calls are queued on the dial scheduler together. Returns 202 once
+# they are queued; each inquiry's vapi_call_id is written as its call is placed and
+# shows up on /moving_queries/{id}/status and the event stream.
+@app.post("/moving_queries/{moving_query_id}/call_all", status_code=202)
+async def call_all_moving_companies(moving_query_id: int):
+    moving_query_data, inquiries = await asyncio.gather(
+        get_moving_query(moving_query_id),
+        get_inquiries(moving_query_id),
+    )
+    if not moving_query_data:
+        raise HTTPException(status_code=404, detail="Moving query not found")
+
+    # Inquiries that already have a VAPI call, or that another request is dialing, are
+    # not dialed again
+    pending = await claim_inquiries([inquiry["id"] for inquiry in inquiries if not inquiry.get("vapi_call_id")])
+    if pending:
+        services.start_calls(moving_query_data[0], pending, trace_parent=query_trace(moving_query_data[0]))
+
+    return {
+        "moving_query_id": moving_query_id,
+        "calls_queued": len(pending),
+        "inquiry_ids": [inquiry["id"] for inquiry in pending],
+    }
+
+# Streams inquiry changes (vapi_call_id assigned, call finished) for a moving query as
+# server-sent events, so clients don't have to poll the inquiry table
+@app.get("/moving_queries/{moving_query_id}/events")
+async def moving_query_events(moving_query_id: int, request: Request):
+    return StreamingResponse(
+        inquiry_stream.events(moving_query_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+# Where a moving query is: its discovery job, and how many of its companies have been
+# called and have reported a quote
+@app.get("/moving_queries/{moving_query_id}/status")
+async def moving_query_status(moving_query_id: int):
+    discovery = await asyncio.to_thread(jobs.discovery_status, moving_query_id)
+    moving_query_data, inquiries = await asyncio.gather(
+        get_moving_query(moving_query_id),
+        get_inquiries(moving_query_id),
+    )
+    if not moving_query_data:
+        raise HTTPException(status_code=404, detail="Moving query not found")
+    return {
+        "moving_query_id": moving_query_id,
+        "discovery": discovery,
+        "inquiries": len(inquiries),
+        "calls_placed": sum(1 for inquiry in inquiries if inquiry.get("vapi_call_id")),
+        "quotes": sum(1 for inquiry in inquiries if inquiry.get("price") not in (None, -1)),
+    }
+
+# The spans of a moving query's trace still held in memory by this process, with totals
+# per stage and the time from the query to its first quote. With several workers the
+# quote's span is often in another worker, leaving time_to_first_quote_seconds None; the
+# full trace is in TRACE_EXPORT_PATH.
+@app.get("/moving_queries/{moving_query_id}/trace")
+async def moving_query_trace(moving_query_id: int):
+    moving_query_data = await get_moving_query(moving_query_id)
+    if not moving_query_data:
+        raise HTTPException(status_code=404, detail="Moving query not found")
+    if not moving_query_data[0].get("trace_id"):
+        raise HTTPException(status_code=404, detail="Moving query has no trace")
+    trace = tracing.get_trace(moving_query_data[0]["trace_id"])
+    quotes = [span["end"] for span in trace["spans"] if span["name"] == "quote.received"]
+    trace["time_to_first_quote_seconds"] = min(quotes) - trace["spans"][0]["start"] if quotes else None
+    return trace
+
+# Validates and journals the report, then ACKs right away; the webhook consumer
+# writes it to the database in the background
 @app.post("/vapi_webhook_report/")
-def vapi_webhook_report(json_data: dict):
-    print(json_data)
-    if json_data.get("message", {}).get("type") == "end-of-call-report":
-        # Extract the required fields
-        vapi_id = json_data["message"]["call"]["id"]
-        structured_data_price = json_data["message"]["analysis"]["structured_data"]["price"]
-        summary = json_data["message"]["analysis"]["summary"]
-        transcript = json_data["message"]["transcript"]
-        duration_minutes = json_data["message"]["duration_minutes"]
-        phone_number = json_data["message"]["call"]["customer"]["number"]
-        recording_url = json_data["message"]["stereo_recording_url"]
-
-        print(f"VAPI ID: {vapi_id}")
-        print(f"Structured Data Price: {structured_data_price}")
-        print(f"Summary: {summary}")
-        print(f"Transcript: {transcript}")
-        print(f"Duration Minutes: {duration_minutes}")
-        print(f"Phone Number: {phone_number}")
-        print(f"Recording URL: {recording_url}")
-        
-        update_finished_call(vapi_id, phone_number, structured_data_price, summary, transcript, duration_minutes, recording_url)
-        
-    else:
-        return None
\ No newline at end of file
+async def vapi_webhook_report(json_data: dict):
+    if json_data.get("message", {}).get("type") != "end-of-call-report":
+        return None
+    # The call is over even if the report can't be used (voicemail, a hang-up with no
+    # quote), so its live-call slot is freed before the rest is validated. The limits are
+    # shared, so this frees it whichever worker dialed the call.
+    call = json_data["message"].get("call")
+    if isinstance(call, dict) and isinstance(call.get("id"), str):
+        await services.dialer.call_ended(call["id"])
+    try:
+        report = webhooks.parse_end_of_call_report(json_data)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Malformed end-of-call report: {e!r}")
+
+    logger.debug("end-of-call report", extra=fields(vapi_call_id=report["vapi_call_id"], duration_minutes=report["duration_minutes"]))
+    with tracing.child_span("quote.received", parent=tracing.parse_traceparent(report["traceparent"]), vapi_call_id=report["vapi_call_id"]):
+        if not await webhooks.enqueue(report):
+            return {"status": "duplicate"}
+    return {"status": "queued"}
+
+# The serving worker's view: the caches' disk tiers, the queues and the dial limits are
+# shared, the rest is this process's own (see "pid"); /metrics has the server-wide totals
+@app.get("/stats")
+async def stats():
+    return {
+        "pid": os.getpid(),
+        "geocode_cache": geocode_cache.stats(),
+        "moving_query_cache": database.moving_query_cache.stats(),
+        "places_cache": services.places_cache_stats(),
+        "discovery": services.discovery_stats(),
+        "dialer": services.dialer.stats(),
+        "webhooks": webhooks.stats(),
+        "inquiry_streams": inquiry_stream.stats(),
+        "events": bus.stats(),
+        "event_relay": relay.stats(),
+        "http_clients": clients.stats(),
+        "logs": logs.stats(),
+        "tracing": tracing.stats(),
+        "jobs": jobs.stats(),
+    }
+
+# Prometheus text format: per-dependency latency histograms, outcomes and in-flight work,
+# for the whole server whichever worker is scraped
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(await metrics.render_all(), media_type="text/plain; version=0.0.4")
+
+@app.get("/dialer/stats")
+async def dialer_stats():
+    return services.dialer.stats()
+
+@app.get("/dialer/queue")
+async def dialer_queue():
+    return services.dialer.queue()
@@ -1,38 +1,66 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float
-from sqlalchemy.orm import relationship
-from app.database.database import Base
 import datetime
+from typing import Optional
+from sqlalchemy import DateTime, Float, ForeignKey, Integer, String, Boolean, func
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+# These mirror the Supabase tables column for column, so both storage backends
+# hand the same row dictionaries back to the rest of the app.
+
+
+class Base(DeclarativeBase):
+    pass
+
 
 class MovingQuery(Base):
-    __tablename__ = 'moving_queries'
-
-    id = Column(Integer, primary_key=True, index=True)
-    location_from = Column(String, index=True)
-    location_to = Column(String, index=True)
-    date = Column(String)
-    items = Column(String)
-    quotes_found = Column(Boolean, default=False)
-    moving_companies_count = Column(Integer)
-    moving_company_ids = Column(String)
-    phone_call_information_ids = Column(String)
+    __tablename__ = 'moving_query'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    location_from: Mapped[str] = mapped_column(String)
+    location_to: Mapped[str] = mapped_column(String)
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
+    items: Mapped[str] = mapped_column(String)
+    items_details: Mapped[str] = mapped_column(String)
+    availability: Mapped[str] = mapped_column(String)
+    user_id: Mapped[Optional[str]] = mapped_column(String, index=True)
+    # Geocoded when the query is created; to_* stay null if the destination can't be
+    from_latitude: Mapped[Optional[float]] = mapped_column(Float)
+    from_longitude: Mapped[Optional[float]] = mapped_column(Float)
+    to_latitude: Mapped[Optional[float]] = mapped_column(Float)
+    to_longitude: Mapped[Optional[float]] = mapped_column(Float)
+    # Ties the query's discovery, calls and webhooks together in one trace
+    trace_id: Mapped[Optional[str]] = mapped_column(String)
+
 
 class MovingCompany(Base):
-    __tablename__ = 'moving_companies'
+    __tablename__ = 'moving_company'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String)
+    address: Mapped[Optional[str]] = mapped_column(String)
+    rating: Mapped[Optional[float]] = mapped_column(Float)
+    user_ratings_total: Mapped[Optional[int]] = mapped_column(Integer)
+    latitude: Mapped[Optional[float]] = mapped_column(Float)
+    longitude: Mapped[Optional[float]] = mapped_column(Float)
+    phone_number: Mapped[str] = mapped_column(String, unique=True)
+    coverImage: Mapped[Optional[str]] = mapped_column(String)
 
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
-    phone_number = Column(String, index=True)
-    latitude = Column(Float)
-    longitude = Column(Float)
 
-class PhoneCalls(Base):
-    __tablename__ = 'phone_calls'
+class MovingInquiry(Base):
+    __tablename__ = 'moving_inquiry'
 
-    id = Column(Integer, primary_key=True, index=True)
-    date = Column(String)
-    duration = Column(Integer)
-    transcript = Column(String)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    moving_query_id: Mapped[int] = mapped_column(ForeignKey("moving_query.id"), index=True)
+    moving_company_id: Mapped[int] = mapped_column(ForeignKey("moving_company.id"))
+    phone_number: Mapped[str] = mapped_column(String)
+    price: Mapped[float] = mapped_column(Float, default=-1)
+    phone_call_transcript: Mapped[str] = mapped_column(String, default="")
+    summary: Mapped[Optional[str]] = mapped_column(String)
+    call_duration: Mapped[Optional[float]] = mapped_column(Float)
+    recording_url: Mapped[Optional[str]] = mapped_column(String)
+    in_progress: Mapped[bool] = mapped_column(Boolean, default=False)
+    vapi_call_id: Mapped[Optional[str]] = mapped_column(String, index=True)
 
-    moving_query = relationship("MovingQuery", back_populates="phone_calls")
-    moving_company_id = Column(Integer, index=True)
 
+def to_dict(row: Base) -> dict:
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns}
@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Durable work queue in a SQLite table (WAL mode). Items survive restarts: anything that
+# was claimed but never acked becomes claimable again once its lease runs out, so several
+# consumers (or processes) can share one queue file.
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+class SQLiteQueue:
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT '{PENDING}',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT,
+                dedupe_key TEXT
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({name})")}
+        if "dedupe_key" not in columns:
+            self._conn.execute(f"ALTER TABLE {name} ADD COLUMN dedupe_key TEXT")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_claim ON {name} (status, available_at)")
+        self._conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_dedupe ON {name} (dedupe_key)")
+
+    def _execute(self, sql: str, parameters=()):
+        with self._lock:
+            return self._conn.execute(sql, parameters)
+
+    # Appends an item and returns its id. If an item with the same dedupe_key is already
+    # in the queue nothing is added and None is returned.
+    def put(self, payload: dict, dedupe_key: str = None):
+        now = time.time()
+        cursor = self._execute(
+            f"INSERT OR IGNORE INTO {self.name} (payload, available_at, created_at, updated_at, dedupe_key) VALUES (?, ?, ?, ?, ?)",
+            (json.dumps(payload), now, now, now, dedupe_key),
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    # Atomically leases up to `limit` ready items for `lease` seconds.
+    # Returns (id, payload, attempts) tuples, oldest first.
+    def claim(self, limit: int, lease: float = 60) -> list:
+        now = time.time()
+        rows = self._execute(
+            f"""
+            UPDATE {self.name}
+            SET status = '{PROCESSING}', attempts = attempts + 1, available_at = ?, updated_at = ?
+            WHERE id IN (
+                SELECT id FROM {self.name}
+                WHERE status IN ('{PENDING}', '{PROCESSING}') AND available_at <= ?
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, payload, attempts
+            """,
+            (now + lease, now, now, limit),
+        ).fetchall()
+        return sorted((row[0], json.loads(row[1]), row[2]) for row in rows)
+
+    def ack(self, ids: list):
+        if not ids:
+            return
+        self._execute(
+            f"UPDATE {self.name} SET status = '{DONE}', updated_at = ? WHERE id IN ({','.join('?' * len(ids))})",
+            (time.time(), *ids),
+        )
+
+    # Makes an item claimable again after `delay` seconds
+    def retry(self, id: int, delay: float, error: str = None):
+        now = time.time()
+        self._execute(
+            f"UPDATE {self.name} SET status = '{PENDING}', available_at = ?, updated_at = ?, last_error = ? WHERE id = ?",
+            (now + delay, now, error, id),
+        )
+
+    def fail(self, id: int, error: str = None):
+        self._execute(
+            f"UPDATE {self.name} SET status = '{FAILED}', updated_at = ?, last_error = ? WHERE id = ?",
+            (time.time(), error, id),
+        )
+
+    # The item put with this dedupe_key, as a dict of its columns, or None
+    def find(self, dedupe_key: str):
+        cursor = self._execute(f"SELECT * FROM {self.name} WHERE dedupe_key = ?", (dedupe_key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        item = dict(zip((column[0] for column in cursor.description), row))
+        item["payload"] = json.loads(item["payload"])
+        return item
+
+    # Deletes finished items older than `age` seconds
+    def purge(self, age: float) -> int:
+        return self._execute(
+            f"DELETE FROM {self.name} WHERE status = '{DONE}' AND updated_at <= ?", (time.time() - age,)
+        ).rowcount
+
+    def stats(self) -> dict:
+        counts = dict(self._execute(f"SELECT status, COUNT(*) FROM {self.name} GROUP BY status").fetchall())
+        oldest = self._execute(
+            f"SELECT MIN(created_at) FROM {self.name} WHERE status IN ('{PENDING}', '{PROCESSING}')"
+        ).fetchone()[0]
+        return {
+            "path": self.path,
+            **{status: counts.get(status, 0) for status in (PENDING, PROCESSING, DONE, FAILED)},
+            "oldest_pending_seconds": time.time() - oldest if oldest else 0.0,
+        }
@@ -0,0 +1,109 @@
+import math
+import os
+from collections import defaultdict
+import numpy as np
+from app.services.ranking import EARTH_RADIUS_METERS, haversine_meters, score, top_k
+
+# In-memory spatial index over every moving company we've stored. Coordinates live in
+# NumPy arrays and a uniform lat/lng grid maps each cell to the rows inside it, so a
+# radius query only computes distances for the cells overlapping the search circle.
+
+# Grid cell size in degrees; about 55 km of latitude, so a 50 mile search touches a few cells
+COMPANY_INDEX_CELL_DEGREES = float(os.getenv("COMPANY_INDEX_CELL_DEGREES", "0.5"))
+
+
+# Shape a moving_company row like the companies find_nearby_companies returns
+def company_from_row(row: dict) -> dict:
+    return {
+        "name": row["name"],
+        "address": row.get("address"),
+        "rating": row.get("rating"),
+        "user_ratings_total": row.get("user_ratings_total"),
+        "latitude": row["latitude"],
+        "longitude": row["longitude"],
+        "phone_number": row["phone_number"],
+        "cover_image_url": row.get("cover_image_url", row.get("coverImage")),
+    }
+
+
+class CompanyIndex:
+    def __init__(self, cell_degrees: float = COMPANY_INDEX_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.companies = []  # row -> company dict
+        self.rows = {}  # phone_number -> row
+        self.cells = defaultdict(list)  # (lat cell, lng cell) -> rows
+        self.lats = np.empty(0)
+        self.lngs = np.empty(0)
+        self.ratings = np.empty(0)
+        self.review_counts = np.empty(0)
+        self.queries = 0
+
+    def _cell(self, lat: float, lng: float) -> tuple:
+        return math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees)
+
+    def load(self, rows: list):
+        self.companies, self.rows, self.cells = [], {}, defaultdict(list)
+        self.lats, self.lngs = np.empty(0), np.empty(0)
+        self.ratings, self.review_counts = np.empty(0), np.empty(0)
+        self.add(company_from_row(row) for row in rows)
+
+    # Adds new companies and refreshes known ones (matched on phone_number)
+    def add(self, companies):
+        new = []
+        for company in companies:
+            if company.get("latitude") is None or company.get("longitude") is None:
+                continue
+            row = self.rows.get(company["phone_number"])
+            if row is None:
+                new.append(company)
+                continue
+            old = self.companies[row]
+            if (old["latitude"], old["longitude"]) != (company["latitude"], company["longitude"]):
+                self.cells[self._cell(old["latitude"], old["longitude"])].remove(row)
+                self.cells[self._cell(company["latitude"], company["longitude"])].append(row)
+            self.companies[row] = company
+            self.lats[row], self.lngs[row] = company["latitude"], company["longitude"]
+            self.ratings[row] = company["rating"] or 0.0
+            self.review_counts[row] = company["user_ratings_total"] or 0
+
+        if not new:
+            return
+        first = len(self.companies)
+        for row, company in enumerate(new, start=first):
+            self.companies.append(company)
+            self.rows[company["phone_number"]] = row
+            self.cells[self._cell(company["latitude"], company["longitude"])].append(row)
+        self.lats = np.concatenate([self.lats, [company["latitude"] for company in new]])
+        self.lngs = np.concatenate([self.lngs, [company["longitude"] for company in new]])
+        self.ratings = np.concatenate([self.ratings, [company["rating"] or 0.0 for company in new]])
+        self.review_counts = np.concatenate([self.review_counts, [company["user_ratings_total"] or 0 for company in new]])
+
+    # Rows in the grid cells overlapping the bounding box of the circle
+    def _candidates(self, lat: float, lng: float, radius: float) -> np.ndarray:
+        lat_span = math.degrees(radius / EARTH_RADIUS_METERS)
+        lng_span = lat_span / max(math.cos(math.radians(lat)), 1e-6)
+        lat_low, lng_low = self._cell(lat - lat_span, lng - lng_span)
+        lat_high, lng_high = self._cell(lat + lat_span, lng + lng_span)
+        rows = []
+        for lat_cell in range(lat_low, lat_high + 1):
+            for lng_cell in range(lng_low, lng_high + 1):
+                rows.extend(self.cells.get((lat_cell, lng_cell), ()))
+        return np.array(rows, dtype=np.intp)
+
+    # Companies within radius meters of the point, best first by the ranking score
+    def nearby(self, lat: float, lng: float, radius: float, limit: int = None) -> list:
+        self.queries += 1
+        rows = self._candidates(lat, lng, radius)
+        if rows.size == 0:
+            return []
+        distances = haversine_meters(lat, lng, self.lats[rows], self.lngs[rows])
+        inside = distances <= radius
+        rows, distances = rows[inside], distances[inside]
+        scores = score(distances, self.ratings[rows], self.review_counts[rows], radius)
+        return [self.companies[row] for row in rows[top_k(scores, limit)]]
+
+    def __len__(self):
+        return len(self.companies)
+
+    def stats(self) -> dict:
+        return {"companies": len(self.companies), "cells": len(self.cells), "queries": self.queries}
@@ -0,0 +1,373 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import httpx
+from dotenv import load_dotenv
+from app.telemetry import tracing
+from app.telemetry.logs import Lazy, fields
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# These limits are for the whole server: every worker process dials against the same
+# token buckets and live-call slots in the VAPI_LIMITS_PATH SQLite file
+VAPI_CALLS_PER_SECOND = float(os.getenv("VAPI_CALLS_PER_SECOND", "2"))
+VAPI_CALL_BURST = int(os.getenv("VAPI_CALL_BURST", "5"))
+VAPI_MAX_LIVE_CALLS = int(os.getenv("VAPI_MAX_LIVE_CALLS", "10"))
+VAPI_DIAL_WORKERS = int(os.getenv("VAPI_CALL_CONCURRENCY", "5"))
+VAPI_MAX_ATTEMPTS = int(os.getenv("VAPI_MAX_ATTEMPTS", "4"))
+# A live call whose end-of-call report never arrives frees its slot after this many seconds
+VAPI_LIVE_CALL_TIMEOUT = float(os.getenv("VAPI_LIVE_CALL_TIMEOUT", "900"))
+VAPI_LIMITS_PATH = os.getenv("VAPI_LIMITS_PATH", "dialer.db")
+# How long a process waits for another's write lock on the limits file
+VAPI_LIMITS_BUSY_TIMEOUT = float(os.getenv("VAPI_LIMITS_BUSY_TIMEOUT", "5"))
+# How often a worker waiting for a free live-call slot checks whether another process
+# released one (releases in this process wake it right away)
+VAPI_LIMITS_POLL_INTERVAL = float(os.getenv("VAPI_LIMITS_POLL_INTERVAL", "0.5"))
+# A dial whose process dies before VAPI answers frees its slot after this many seconds
+VAPI_DIAL_LEASE = 120
+
+# Lower numbers are dialed first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# Rate and live-call limits for every VAPI phone number, in a SQLite table (WAL mode) that
+# all of the server's processes share. Each phone number has a token bucket row (`rate`
+# tokens per second, holding at most `burst`) and a slot row for every dial in flight and
+# every live call. Slots carry an expiry, so the ones a crashed process held free
+# themselves. The methods block; the scheduler runs them in a thread.
+class SQLiteDialLimits:
+    def __init__(self, path: str, calls_per_second: float, burst: int, max_live_calls: int):
+        self.path = path
+        self.rate = calls_per_second
+        self.burst = burst
+        self.max_live_calls = max_live_calls
+        self.lines = {}  # phone id -> slot counts as of this process's last look
+        self.timed_out = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=VAPI_LIMITS_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dial_buckets (phone_id TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dial_slots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phone_id TEXT NOT NULL,
+                vapi_call_id TEXT,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dial_slots_phone ON dial_slots (phone_id, expires_at)")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS dial_slots_call ON dial_slots (vapi_call_id)")
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _count(self, phone_id: str) -> int:
+        live, slots = self._conn.execute(
+            "SELECT COUNT(vapi_call_id), COUNT(*) FROM dial_slots WHERE phone_id = ?", (phone_id,)
+        ).fetchone()
+        self.lines[phone_id] = {"live": live, "dialing": slots - live}
+        return slots
+
+    # Takes a slot and a token for the phone number. Returns (0, slot id), or (seconds
+    # until a token is due, None), or (None, None) if every slot is taken and only a
+    # release can free one.
+    def try_acquire(self, phone_id: str, lease: float = VAPI_DIAL_LEASE):
+        def take():
+            now = time.time()
+            expired = self._conn.execute(
+                "DELETE FROM dial_slots WHERE phone_id = ? AND expires_at <= ? RETURNING vapi_call_id", (phone_id, now)
+            ).fetchall()
+            self.timed_out += sum(1 for (vapi_call_id,) in expired if vapi_call_id is not None)
+            if self._count(phone_id) >= self.max_live_calls:
+                return None, None
+            row = self._conn.execute("SELECT tokens, updated_at FROM dial_buckets WHERE phone_id = ?", (phone_id,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + max(now - row[1], 0) * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate, None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dial_buckets (phone_id, tokens, updated_at) VALUES (?, ?, ?)",
+                (phone_id, tokens - 1, now),
+            )
+            slot = self._conn.execute(
+                "INSERT INTO dial_slots (phone_id, expires_at) VALUES (?, ?)", (phone_id, now + lease)
+            ).lastrowid
+            self._count(phone_id)
+            return 0.0, slot
+
+        return self._transaction(take)
+
+    # The dial on this slot was answered: it holds the slot as a live call until the call
+    # is released or `timeout` seconds pass
+    def connect(self, slot: int, phone_id: str, vapi_call_id: str, timeout: float):
+        def hold():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dial_slots (id, phone_id, vapi_call_id, expires_at) VALUES (?, ?, ?, ?)",
+                (slot, phone_id, vapi_call_id, time.time() + timeout),
+            )
+            self._count(phone_id)
+
+        self._transaction(hold)
+
+    # Frees the slot of a dial that didn't become a call
+    def free(self, slot: int):
+        def delete():
+            row = self._conn.execute("DELETE FROM dial_slots WHERE id = ? RETURNING phone_id", (slot,)).fetchone()
+            if row is not None:
+                self._count(row[0])
+
+        self._transaction(delete)
+
+    # Frees the slot of a finished call, whichever process dialed it. Returns whether the
+    # call held one.
+    def release(self, vapi_call_id: str) -> bool:
+        def delete():
+            row = self._conn.execute(
+                "DELETE FROM dial_slots WHERE vapi_call_id = ? RETURNING phone_id", (vapi_call_id,)
+            ).fetchone()
+            if row is not None:
+                self._count(row[0])
+            return row is not None
+
+        return self._transaction(delete)
+
+
+@dataclass(order=True)
+class DialRequest:
+    priority: int
+    sequence: int
+    phone_id: str = field(compare=False)
+    payload: dict = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+    trace_parent: object = field(default=None, compare=False)  # the submitter's span
+    slot: int = field(default=None, compare=False)  # the live-call slot _next took for it
+
+
+# Backoff for the given attempt: full jitter over an exponentially growing window,
+# unless the provider told us how long to wait
+def backoff_delay(attempt: int, response: httpx.Response = None, base: float = 0.5, cap: float = 30.0) -> float:
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after and retry_after.replace(".", "", 1).isdigit():
+            return min(cap, float(retry_after))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Per-process scheduler in front of the VAPI call API. Pending calls wait in a priority
+# queue until their phone number has a free live-call slot and a token in the shared
+# limits; only then does a worker take one off and dial it, so a call submitted later at a
+# higher priority still goes first. 429/5xx responses are retried with jittered backoff.
+class DialScheduler:
+    def __init__(self, send, workers: int = VAPI_DIAL_WORKERS, calls_per_second: float = VAPI_CALLS_PER_SECOND,
+                 burst: int = VAPI_CALL_BURST, max_live_calls: int = VAPI_MAX_LIVE_CALLS,
+                 max_attempts: int = VAPI_MAX_ATTEMPTS, live_call_timeout: float = VAPI_LIVE_CALL_TIMEOUT,
+                 limits_path: str = VAPI_LIMITS_PATH):
+        self.send = send  # async (payload) -> httpx.Response
+        self.worker_count = workers
+        self.max_attempts = max_attempts
+        self.live_call_timeout = live_call_timeout
+        self.limits = SQLiteDialLimits(limits_path, calls_per_second, burst, max_live_calls)
+        self._queue = None
+        self._workers = []
+        self._loop = None
+        self._gate = None
+        self._capacity = None
+        self._sequence = itertools.count()
+        self._retrying = 0
+        self._wait_times = deque(maxlen=1000)
+        self.counters = {"submitted": 0, "dialed": 0, "failed": 0, "retried": 0, "ended": 0, "abandoned": 0}
+
+    def start(self):
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._gate = asyncio.Lock()
+        self._capacity = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # Runs a limits method in a thread. If the limits file can't be reached the error is
+    # logged and None returned: the dial waits, and a slot it can't free expires.
+    async def _limits(self, method, *args):
+        try:
+            return await asyncio.to_thread(method, *args)
+        except sqlite3.Error as e:
+            logger.warning("dial limits unavailable", extra=fields(path=self.limits.path, error=repr(e)))
+            return None
+
+    # Queues a call and waits until VAPI accepts it (returns the call id) or gives up (None)
+    async def submit(self, payload: dict, priority: int = PRIORITY_BATCH):
+        self.start()
+        request = DialRequest(
+            priority=priority,
+            sequence=next(self._sequence),
+            phone_id=payload.get("phoneNumberId") or "",
+            payload=payload,
+            future=self._loop.create_future(),
+            enqueued_at=time.monotonic(),
+            trace_parent=tracing.current(),
+        )
+        self.counters["submitted"] += 1
+        self._queue.put_nowait(request)
+        self._capacity.set()
+        return await request.future
+
+    # Takes the most urgent request off the queue once its line can dial it. One worker
+    # at a time waits here; the rest wait for it.
+    async def _next(self) -> DialRequest:
+        async with self._gate:
+            while True:
+                request = await self._queue.get()
+                # The submitter was cancelled (a shutdown, a released inquiry): drop it
+                if request.future.done():
+                    self.counters["abandoned"] += 1
+                    self._queue.task_done()
+                    continue
+                wait, request.slot = await self._limits(self.limits.try_acquire, request.phone_id) or (None, None)
+                if wait == 0:
+                    if request.attempts == 0:
+                        self._wait_times.append(time.monotonic() - request.enqueued_at)
+                    return request
+                # Back in the queue until a slot frees up or a token is due
+                self._queue.put_nowait(request)
+                self._queue.task_done()
+                self._capacity.clear()
+                try:
+                    await asyncio.wait_for(self._capacity.wait(), timeout=wait or VAPI_LIMITS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _work(self):
+        while True:
+            request = await self._next()
+            # Cancelled while its slot was being taken
+            if request.future.done():
+                self.counters["abandoned"] += 1
+                await self._free_slot(request)
+                self._queue.task_done()
+                continue
+            try:
+                with tracing.child_span("vapi.dial", parent=request.trace_parent, attempt=request.attempts + 1):
+                    await self._dial(request)
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    # Frees the slot _next took and wakes the worker waiting for one
+    async def _free_slot(self, request: DialRequest):
+        await self._limits(self.limits.free, request.slot)
+        self._capacity.set()
+
+    # Dials a request whose line slot and token _next already took
+    async def _dial(self, request: DialRequest):
+        request.attempts += 1
+
+        response = None
+        try:
+            response = await self.send(request.payload)
+        except httpx.TransportError as e:
+            logger.warning("VAPI request failed", extra=fields(error=repr(e), attempt=request.attempts))
+        except BaseException:
+            await self._free_slot(request)
+            raise
+
+        if response is not None and response.status_code == 201:
+            vapi_call_id = response.json().get("id")
+            self.counters["dialed"] += 1
+            await self._limits(self.limits.connect, request.slot, request.phone_id, vapi_call_id, self.live_call_timeout)
+            if not request.future.done():
+                request.future.set_result(vapi_call_id)
+            return
+
+        await self._free_slot(request)
+        retryable = response is None or response.status_code in RETRYABLE_STATUS_CODES
+        if retryable and request.attempts < self.max_attempts:
+            self.counters["retried"] += 1
+            self._retrying += 1
+            self._loop.call_later(backoff_delay(request.attempts, response), self._requeue, request)
+            return
+
+        self.counters["failed"] += 1
+        logger.error("failed to create call", extra=fields(
+            attempts=request.attempts,
+            status=response.status_code if response is not None else None,
+            body=Lazy(lambda: response.text) if response is not None else None,
+        ))
+        if not request.future.done():
+            request.future.set_result(None)
+
+    def _requeue(self, request: DialRequest):
+        self._retrying -= 1
+        self._queue.put_nowait(request)
+
+    # Frees the live-call slot held by a finished call, whichever process dialed it
+    async def call_ended(self, vapi_call_id: str):
+        if await self._limits(self.limits.release, vapi_call_id):
+            self.counters["ended"] += 1
+            if self._capacity is not None:
+                self._capacity.set()
+
+    def queue(self) -> list:
+        if self._queue is None:
+            return []
+        now = time.monotonic()
+        return [
+            {"priority": request.priority, "phone_id": request.phone_id, "attempts": request.attempts,
+             "waiting_seconds": now - request.enqueued_at}
+            for request in sorted(self._queue._queue)
+        ]
+
+    # Live calls are the whole server's, as of this process's last dial or release
+    def stats(self) -> dict:
+        waits = sorted(self._wait_times)
+        pending = self.queue()
+        return {
+            "queue_depth": len(pending),
+            "retrying": self._retrying,
+            "oldest_wait_seconds": max((entry["waiting_seconds"] for entry in pending), default=0.0),
+            "wait_seconds": {
+                "samples": len(waits),
+                "avg": sum(waits) / len(waits) if waits else 0.0,
+                "p50": waits[len(waits) // 2] if waits else 0.0,
+                "p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "max": waits[-1] if waits else 0.0,
+            },
+            "live_calls": {
+                phone_id: {**counts, "max": self.limits.max_live_calls}
+                for phone_id, counts in self.limits.lines.items()
+            },
+            **self.counters,
+            "timed_out": self.limits.timed_out,
+        }
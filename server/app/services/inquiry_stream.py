@@ -0,0 +1,42 @@
+import asyncio
+import json
+from app.events.events import bus, DROP_OLDEST, InquiryCreated, CallDialed, CallFinished
+
+# Pushes moving_inquiry changes to clients streaming GET /moving_queries/{id}/events.
+# Each open stream is an event bus subscription filtered to its moving query. A stalled
+# client only ever loses its own oldest updates and never holds up the database writes.
+
+SUBSCRIBER_QUEUE_SIZE = 100
+# Comment line sent when nothing has changed, so proxies keep the connection open
+HEARTBEAT_INTERVAL = 15.0
+
+open_streams = 0
+
+
+# Server-sent events for one moving query until the client disconnects
+async def events(moving_query_id: int, request):
+    global open_streams
+    subscription = bus.subscribe(
+        InquiryCreated, CallDialed, CallFinished,
+        maxsize=SUBSCRIBER_QUEUE_SIZE,
+        where=lambda event: event.moving_query_id == moving_query_id,
+        overflow=DROP_OLDEST,
+    )
+    open_streams += 1
+    try:
+        yield ": connected\n\n"
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            delta = {"id": event.inquiry_id, "moving_query_id": event.moving_query_id, **event.columns()}
+            yield f"event: inquiry\ndata: {json.dumps(delta, default=str)}\n\n"
+    finally:
+        open_streams -= 1
+        subscription.close()
+
+
+def stats() -> dict:
+    return {"streams": open_streams}
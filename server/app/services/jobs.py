@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from app.clients.clients import clients
+from app.database import database
+from app.database.database import get_inquiries, get_moving_query
+from app.events import relay
+from app.queue.sqlite_queue import SQLiteQueue
+from app.schemas import schemas
+from app.services import services
+from app.telemetry import logs, metrics, tracing
+from app.telemetry.logs import fields
+from app.telemetry.metrics import Counter, Histogram
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Durable background jobs. Discovery for a new moving query is journaled here instead of
+# running as a FastAPI BackgroundTask, so it survives restarts, is retried with backoff,
+# and runs on a fixed number of workers however fast queries arrive. Workers run inside
+# the web process (JOB_WORKERS of them) and/or as a separate process sharing the file:
+#
+#   python -m app.services.jobs
+
+JOBS_PATH = os.getenv("JOBS_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# A claimed job that isn't finished within the lease (e.g. its worker died) runs again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_INTERVAL = 1.0
+JOB_RETENTION = 7 * 24 * 3600
+
+DISCOVERY = "discovery"
+
+queue = SQLiteQueue(JOBS_PATH, "jobs")
+jobs_total = Counter("jobs_total", "Background jobs finished, by kind and outcome", ("kind", "outcome"))
+job_wait_seconds = Histogram("job_wait_seconds", "Time from enqueue to a worker starting the job", ("kind",))
+
+_wakeup = None
+_workers = []
+
+
+# A failure retrying won't fix; the job is marked failed right away
+class PermanentJobError(Exception):
+    pass
+
+
+def discovery_key(moving_query_id: int) -> str:
+    return f"{DISCOVERY}:{moving_query_id}"
+
+
+# Journals discovery for a moving query; returns once it is durably on disk. A query is
+# only ever discovered once, so enqueueing it again is a no-op.
+async def enqueue_discovery(moving_query_id: int, trace_parent=None):
+    payload = {
+        "kind": DISCOVERY,
+        "moving_query_id": moving_query_id,
+        "enqueued_at": time.time(),
+        "traceparent": tracing.traceparent(trace_parent) if trace_parent is not None else None,
+    }
+    job_id = await asyncio.to_thread(queue.put, payload, discovery_key(moving_query_id))
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_id
+
+
+async def run_discovery(payload: dict, attempts: int):
+    moving_query_id = payload["moving_query_id"]
+    # A retry after the companies were saved would insert the inquiries twice
+    if attempts > 1 and await get_inquiries(moving_query_id):
+        return
+    moving_query_data = await get_moving_query(moving_query_id)
+    if not moving_query_data:
+        raise PermanentJobError("moving query not found")
+    moving_query = moving_query_data[0]
+    origin = None
+    if moving_query.get("from_latitude") is not None:
+        origin = (moving_query["from_latitude"], moving_query["from_longitude"])
+    await services.get_moving_companies(
+        schemas.MovingQuery(**moving_query), moving_query_id, origin,
+        trace_parent=tracing.parse_traceparent(payload.get("traceparent")),
+    )
+
+
+handlers = {DISCOVERY: run_discovery}
+
+
+async def run_job(job_id: int, payload: dict, attempts: int):
+    kind = payload["kind"]
+    job_wait_seconds.observe(max(time.time() - payload["enqueued_at"], 0.0), kind=kind)
+    try:
+        await handlers[kind](payload, attempts)
+    except Exception as e:
+        # Client errors (a location that can't be geocoded) won't change on retry
+        permanent = isinstance(e, PermanentJobError) or (isinstance(e, HTTPException) and e.status_code < 500)
+        if permanent or attempts >= JOB_MAX_ATTEMPTS:
+            logger.error("job failed", extra=fields(job_id=job_id, kind=kind, attempts=attempts, error=repr(e)), exc_info=True)
+            jobs_total.inc(kind=kind, outcome="failed")
+            await asyncio.to_thread(queue.fail, job_id, repr(e))
+        else:
+            logger.warning("job will be retried", extra=fields(job_id=job_id, kind=kind, attempts=attempts, error=repr(e)))
+            jobs_total.inc(kind=kind, outcome="retried")
+            await asyncio.to_thread(queue.retry, job_id, random.uniform(0, 2 ** attempts), repr(e))
+        return
+    jobs_total.inc(kind=kind, outcome="done")
+    await asyncio.to_thread(queue.ack, [job_id])
+
+
+async def work():
+    while True:
+        claimed = await asyncio.to_thread(queue.claim, 1, JOB_LEASE_SECONDS)
+        if claimed:
+            await run_job(*claimed[0])
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start(workers: int = JOB_WORKERS):
+    global _wakeup, _workers
+    if _workers or workers <= 0:
+        return
+    queue.purge(JOB_RETENTION)
+    _wakeup = asyncio.Event()
+    _workers = [asyncio.create_task(work()) for _ in range(workers)]
+
+
+async def stop():
+    global _workers
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers = []
+
+
+# Status of a moving query's discovery job, or None if it was never enqueued
+def discovery_status(moving_query_id: int):
+    job = queue.find(discovery_key(moving_query_id))
+    if job is None:
+        return None
+    return {
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "last_error": job["last_error"],
+        "enqueued_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+def stats() -> dict:
+    return {"workers": len(_workers), "queue": queue.stats()}
+
+
+# Standalone worker process: python -m app.services.jobs
+async def main():
+    logs.setup()
+    clients.start()
+    await database.init()
+    await services.load_company_index()
+    relay.start()
+    # Discovery timings from this process show up on the web workers' /metrics
+    metrics.start()
+    index_saved_companies = asyncio.create_task(services.index_saved_companies())
+    start()
+    try:
+        await asyncio.gather(*_workers)
+    finally:
+        await stop()
+        index_saved_companies.cancel()
+        await asyncio.gather(index_saved_companies, return_exceptions=True)
+        await metrics.stop()
+        await relay.stop()
+        await database.close()
+        await clients.close()
+        tracing.shutdown()
+        logs.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+import math
+import os
+import numpy as np
+
+# Ranks moving company candidates around an origin. Distances for every candidate are
+# computed in one NumPy pass; the score blends proximity with a Bayesian average rating,
+# so a 5.0 from three reviews doesn't outrank a 4.7 from four hundred.
+
+EARTH_RADIUS_METERS = 6371008.8
+# The rating a company is assumed to have before its reviews are counted, and how many
+# reviews that assumption is worth
+RANKING_PRIOR_RATING = float(os.getenv("RANKING_PRIOR_RATING", "3.5"))
+RANKING_PRIOR_REVIEWS = float(os.getenv("RANKING_PRIOR_REVIEWS", "20"))
+# Share of the score that comes from proximity rather than rating
+RANKING_DISTANCE_WEIGHT = float(os.getenv("RANKING_DISTANCE_WEIGHT", "0.3"))
+
+
+# Great-circle distance in meters from one point to arrays of points
+def haversine_meters(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+
+def bayesian_rating(ratings: np.ndarray, review_counts: np.ndarray) -> np.ndarray:
+    return (RANKING_PRIOR_REVIEWS * RANKING_PRIOR_RATING + ratings * review_counts) / (RANKING_PRIOR_REVIEWS + review_counts)
+
+
+# Score in [0, 1] from distances (meters, within radius), ratings (0-5) and review counts
+def score(distances: np.ndarray, ratings: np.ndarray, review_counts: np.ndarray, radius: float) -> np.ndarray:
+    proximity = 1 - np.clip(distances / radius, 0, 1)
+    return (1 - RANKING_DISTANCE_WEIGHT) * bayesian_rating(ratings, review_counts) / 5 + RANKING_DISTANCE_WEIGHT * proximity
+
+
+# Positions of the k highest scores, best first
+def top_k(scores: np.ndarray, k: int = None) -> np.ndarray:
+    if k is not None and k < scores.size:
+        candidates = np.argpartition(-scores, max(k - 1, 0))[:k]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+
+# Ranks company dicts (latitude, longitude, rating, user_ratings_total) by score around
+# the origin and returns the best k within radius. Missing ratings and counts are 0.
+def rank_companies(lat: float, lng: float, companies: list, radius: float, k: int = None) -> list:
+    if not companies:
+        return []
+    lats = np.fromiter((company["latitude"] for company in companies), dtype=float, count=len(companies))
+    lngs = np.fromiter((company["longitude"] for company in companies), dtype=float, count=len(companies))
+    ratings = np.fromiter((company.get("rating") or 0.0 for company in companies), dtype=float, count=len(companies))
+    review_counts = np.fromiter((company.get("user_ratings_total") or 0 for company in companies), dtype=float, count=len(companies))
+
+    distances = haversine_meters(lat, lng, lats, lngs)
+    inside = np.flatnonzero(distances <= radius)
+    scores = score(distances[inside], ratings[inside], review_counts[inside], radius)
+    return [companies[i] for i in inside[top_k(scores, k)]]
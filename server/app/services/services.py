@@ -1,87 +1,419 @@
+import asyncio
+import logging
+from contextlib import contextmanager
 from sqlalchemy.orm import Session
 from fastapi import APIRouter, HTTPException
 import httpx
-import requests
-from app.utils import get_lat_long
+from app.cache.cache import MISSING, SQLiteCache, TieredCache, TTLCache
+from app.clients.clients import clients
+from app.utils import CACHE_DB_PATH, geocode_batch, geocode_cache, get_lat_long, normalize_phone_number
 # from app.models import models
 from app.schemas import schemas
-from app.database.database import get_or_create_moving_company, create_inquiry, update_vapi_id
+from app.events.events import DROP_OLDEST, CompaniesSaved, bus
+from app.services.company_index import CompanyIndex
+from app.services.ranking import rank_companies
+from app.services.dialer import DialScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from app.telemetry import tracing
+from app.telemetry.logs import Sampled, fields
+from app.telemetry.metrics import Gauge, Histogram, background_tasks_in_flight, external_call
+from app.database.database import (
+    upsert_moving_companies, create_inquiries_bulk, list_moving_companies, claim_inquiries, release_inquiries,
+    get_inquiries, update_vapi_ids_bulk,
+)
 import os
 from dotenv import load_dotenv
 
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
+PLACES_API_URL = os.getenv("PLACES_API_URL", "https://maps.googleapis.com/maps/api/place")
+PLACES_DETAILS_CONCURRENCY = int(os.getenv("PLACES_DETAILS_CONCURRENCY", "5"))
+VAPI_API_URL = os.getenv("VAPI_API_URL", "https://api.vapi.ai")
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com")
+SEARCH_RADIUS_METERS = 80467  # 50 miles
+DISCOVERY_LIMIT = 5
+# Searches answered from the local company index need at least this many companies;
+# with fewer, coverage is too thin and Google Places is asked instead
+LOCAL_MIN_COMPANIES = int(os.getenv("LOCAL_MIN_COMPANIES", str(DISCOVERY_LIMIT)))
+# Google serves a search as up to 3 pages of 20; a next_page_token only becomes valid
+# a moment after the page that returned it
+PLACES_MAX_PAGES = 3
+PLACES_PAGE_TOKEN_DELAY = 2.0
+PLACES_PAGE_TOKEN_ATTEMPTS = 3
+# Searches are cached per geocell: lat/lng rounded to this many decimals (2 is ~1.1 km)
+PLACES_GEOCELL_PRECISION = int(os.getenv("PLACES_GEOCELL_PRECISION", "2"))
+DEFAULT_COVER_IMAGE_URL = "https://t4.ftcdn.net/jpg/02/30/62/35/360_F_230623592_cQY0YbsQb523d3b0yqVFupoOxIRGwtEO.jpg"
 
-# Function that takes a city and returns the moving companies in that city
-async def get_moving_companies(moving_query: schemas.MovingQuery, moving_query_id):
-    print(moving_query_id)
-    api_key = os.getenv("MAPS_API_KEY")
+HARDCODED_COMPANY = {
+    "name": "Fred Hua",
+    "address": "123 Example St, Example City, EX 12345",
+    "rating": 4.5,
+    "user_ratings_total": 100,
+    "latitude": 40.7128,  # Example latitude
+    "longitude": -74.0060,  # Example longitude
+    "phone_number": "+14157698863",
+    "cover_image_url": DEFAULT_COVER_IMAGE_URL,
+}
+
+# Every textsearch and Details request is billed, so both are cached. Search results
+# for a geocell change slowly (a day); a place's details rarely do (30 days).
+places_search_cache = TieredCache(
+    memory=TTLCache(maxsize=int(os.getenv("PLACES_SEARCH_CACHE_SIZE", "512"))),
+    disk=SQLiteCache(CACHE_DB_PATH, "places_search_cache"),
+    ttl=float(os.getenv("PLACES_SEARCH_CACHE_TTL", str(24 * 3600))),
+)
+place_details_cache = TieredCache(
+    memory=TTLCache(maxsize=int(os.getenv("PLACE_DETAILS_CACHE_SIZE", "4096"))),
+    disk=SQLiteCache(CACHE_DB_PATH, "place_details_cache"),
+    ttl=float(os.getenv("PLACE_DETAILS_CACHE_TTL", str(30 * 24 * 3600))),
+)
+# Expired rows of the disk caches are deleted at startup and then this often
+CACHE_PURGE_INTERVAL = float(os.getenv("CACHE_PURGE_INTERVAL", "3600"))
+places_counters = {"textsearch_calls": 0, "textsearch_saved": 0, "details_calls": 0, "details_saved": 0}
+
+discovery_stage_seconds = Histogram("discovery_stage_seconds", "Time spent in each stage of company discovery", ("stage",))
+
+
+# Times one discovery stage in the histogram and, within a trace, as a span
+@contextmanager
+def discovery_stage(stage: str):
+    with discovery_stage_seconds.time(stage=stage), tracing.child_span(f"discovery.{stage}"):
+        yield
+
+# Every company we've stored, for nearby lookups without Places. Loaded at startup and
+# extended as discovery saves new companies, in this process or (through the event
+# relay) in any other worker. The hardcoded test company is left out.
+company_index = CompanyIndex()
+discovery_counters = {"local": 0, "places": 0}
+
+
+# Center of the geocell a "lat,lng" location falls in; searches are keyed and sent by cell
+def geocell(location: str) -> str:
+    lat, lng = (float(part) for part in location.split(","))
+    return f"{round(lat, PLACES_GEOCELL_PRECISION)},{round(lng, PLACES_GEOCELL_PRECISION)}"
+
+
+# Places statuses that are an answer; anything else (OVER_QUERY_LIMIT, REQUEST_DENIED,
+# UNKNOWN_ERROR) comes back as HTTP 200 with no results and must not be cached
+PLACES_SEARCH_ANSWERS = ("OK", "ZERO_RESULTS")
+
+
+# One textsearch request; returns the response body, or None on an HTTP error or a status
+# that isn't an answer. Retries while Google answers INVALID_REQUEST because a page token
+# isn't valid yet.
+async def fetch_textsearch_page(client: httpx.AsyncClient, params: dict):
+    for _ in range(PLACES_PAGE_TOKEN_ATTEMPTS):
+        places_counters["textsearch_calls"] += 1
+        with external_call("google_places", "textsearch") as call:
+            response = await client.get(f"{PLACES_API_URL}/textsearch/json", params=params)
+            call.status(response.status_code)
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        if data.get("status") in PLACES_SEARCH_ANSWERS:
+            return data
+        if data.get("status") != "INVALID_REQUEST" or "pagetoken" not in params:
+            logger.warning("places search failed", extra=fields(status=data.get("status")))
+            return None
+        await asyncio.sleep(PLACES_PAGE_TOKEN_DELAY)
+    return None
+
+
+# Yields the result pages of a textsearch one at a time. Later pages are only requested
+# if the consumer keeps iterating. The search is cached as one entry holding the pages
+# fetched so far. Page tokens expire within minutes, so they are never cached: if the
+# consumer wants more pages than the cache holds, the search is run again from the first
+# page and the pages already served are skipped.
+async def textsearch_pages(client: httpx.AsyncClient, query: str, location: str, radius: int, api_key: str, use_cache: bool = True):
+    key = f"{location}:{radius}:{query}"
+    served = 0
+    cached = await places_search_cache.aget(key) if use_cache else MISSING
+    if cached is not MISSING:
+        for results in cached["pages"]:
+            places_counters["textsearch_saved"] += 1
+            yield results
+            served += 1
+        if not cached["more"]:
+            return
+
+    pages = []
+    params = {"query": query, "location": location, "radius": radius, "key": api_key}
+    for page in range(PLACES_MAX_PAGES):
+        data = await fetch_textsearch_page(client, params)
+        if data is None:
+            # Google down or over quota: the discovery job fails and is retried
+            if page == 0:
+                raise HTTPException(status_code=502, detail="Error fetching data from Google Places API")
+            # A later page failing (e.g. an expired token) just ends the search
+            return
+        pages.append(data.get("results", []))
+        next_page_token = data.get("next_page_token")
+        more = bool(next_page_token) and len(pages) < PLACES_MAX_PAGES
+        if use_cache and len(pages) > served:
+            await places_search_cache.aset(key, {"pages": list(pages), "more": more})
+
+        if page >= served:
+            yield pages[-1]
+        if not more:
+            return
+        params = {"pagetoken": next_page_token, "key": api_key}
+
+
+# Fetches the details of a single place, bounded by the shared semaphore
+async def fetch_place_details(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, place_id: str, api_key: str, use_cache: bool = True):
+    if use_cache:
+        cached = await place_details_cache.aget(place_id)
+        if cached is not MISSING:
+            places_counters["details_saved"] += 1
+            return cached
+
+    async with semaphore:
+        # Counted once it is actually sent: a lookup cancelled while queued isn't billed
+        places_counters["details_calls"] += 1
+        with external_call("google_places", "details") as call:
+            details_response = await client.get(f"{PLACES_API_URL}/details/json", params={"place_id": place_id, "key": api_key})
+            call.status(details_response.status_code)
+    if details_response.status_code != 200:
+        return None
+    data = details_response.json()
+    # Only a place Google answered for is cached; a quota or key error is tried again
+    if data.get("status") != "OK":
+        logger.warning("place details failed", extra=fields(status=data.get("status")))
+        return None
+    details = data.get("result", {})
+    if use_cache:
+        await place_details_cache.aset(place_id, details)
+    return details
+
+
+# Keeps the shared disk caches (geocodes, Places searches and details) from growing with
+# entries that expired but whose key was never looked up again
+async def purge_expired_caches():
+    while True:
+        for cache in (geocode_cache, places_search_cache, place_details_cache):
+            purged = await asyncio.to_thread(cache.disk.purge_expired)
+            if purged:
+                logger.info("expired cache entries purged", extra=fields(table=cache.disk.table, purged=purged))
+        await asyncio.sleep(CACHE_PURGE_INTERVAL)
+
+
+def places_cache_stats() -> dict:
+    return {
+        **places_counters,
+        "paid_calls_saved": places_counters["textsearch_saved"] + places_counters["details_saved"],
+        "search": places_search_cache.stats(),
+        "details": place_details_cache.stats(),
+    }
+
+
+async def load_company_index():
+    rows = await list_moving_companies()
+    company_index.load(row for row in rows if row["phone_number"] != HARDCODED_COMPANY["phone_number"])
+    logger.info("company index loaded", extra=fields(companies=len(company_index)))
+
+
+# Adds companies saved by other worker processes to this process's index, so their
+# discoveries are answered locally here too. A process that misses some (the relay
+# dropped them) picks them up at its next start.
+async def index_saved_companies():
+    async with bus.subscribe(CompaniesSaved, maxsize=100, overflow=DROP_OLDEST) as subscription:
+        async for event in subscription:
+            company_index.add(event.companies)
+
+
+def discovery_stats() -> dict:
+    return {**discovery_counters, "index": company_index.stats()}
+
+
+# Yields callable companies around a "lat,lng" location as search pages and Details
+# lookups complete. Each page is ranked on distance, rating and review count and its
+# Details are fetched in that order. Every lookup is billed, so with a `limit` only as
+# many run ahead as companies are still wanted (at most `concurrency`): a lookup that
+# comes back without a phone number makes room for the next one. Lookups still pending
+# when the consumer stops iterating are cancelled.
+async def discover_companies(location: str, api_key: str, concurrency: int = PLACES_DETAILS_CONCURRENCY, use_cache: bool = True, limit: int = None):
+    client = clients.get("google")
     query = "moving company"
-    location = await get_lat_long(moving_query.location_from, api_key)
-    if location is None:
-        raise HTTPException(status_code=400, detail="Invalid location provided")
-    radius = 80467  # 50 miles in meters
-    url = f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={query}&location={location}&radius={radius}&key={api_key}"
+    lat, lng = (float(part) for part in location.split(","))
+    semaphore = asyncio.Semaphore(concurrency)
+    found = 0
 
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail="Error fetching data from Google Places API")
-
-    results = response.json().get("results", [])
-    nearby_companies = []
-
-    for result in results[:5]:
-        place_id = result["place_id"]
-        details_url = f"https://maps.googleapis.com/maps/api/place/details/json?place_id={place_id}&key={api_key}"
-        details_response = requests.get(details_url)
-        if details_response.status_code != 200:
-            continue
-        details_result = details_response.json().get("result", {})
-        phone_number = "+1" + details_result.get("formatted_phone_number").translate({ord(c): None for c in "()- "})
-
-        # Get cover image URL
-        photos = result.get("photos", [])
-        if photos:
-            photo_reference = photos[0].get("photo_reference")
-            cover_image_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photo_reference={photo_reference}&key={api_key}"
+    async for results in textsearch_pages(client, query, geocell(location), SEARCH_RADIUS_METERS, api_key, use_cache):
+        candidates = rank_companies(lat, lng, [place_candidate(result) for result in results], SEARCH_RADIUS_METERS)
+        lookups = {}  # candidate index -> Details task
+        started = 0
+        try:
+            for index, candidate in enumerate(candidates):
+                window = concurrency if limit is None else min(concurrency, max(limit - found, 1))
+                while started < len(candidates) and started - index < window:
+                    lookups[started] = asyncio.create_task(
+                        fetch_place_details(client, semaphore, candidates[started]["place_id"], api_key, use_cache)
+                    )
+                    started += 1
+                company = place_company(candidate, await lookups.pop(index), api_key)
+                if company is not None:
+                    found += 1
+                    yield company
+        finally:
+            for lookup in lookups.values():
+                lookup.cancel()
+            await asyncio.gather(*lookups.values(), return_exceptions=True)
+
+
+# Function that takes a "lat,lng" location and returns up to `limit` nearby moving
+# companies with a phone number. Stops searching (no more pages or Details calls) as soon
+# as it has them. use_cache=False always goes to Google (the benchmarks time real round trips).
+async def find_nearby_companies(location: str, api_key: str, limit: int = DISCOVERY_LIMIT, concurrency: int = PLACES_DETAILS_CONCURRENCY, use_cache: bool = True):
+    nearby_companies = {}  # phone_number -> company; chains list one number at several places
+    companies = discover_companies(location, api_key, concurrency, use_cache, limit=limit)
+    try:
+        async for company in companies:
+            nearby_companies.setdefault(company["phone_number"], company)
+            if len(nearby_companies) >= limit:
+                break
+    finally:
+        await companies.aclose()
+    return list(nearby_companies.values())
+
+
+# Builds the company record from a ranked candidate and its Details, or None if the
+# place can't be called
+def place_company(candidate: dict, details_result: dict, api_key: str):
+    if not details_result:
+        return None
+    phone_number = normalize_phone_number(
+        details_result.get("international_phone_number") or details_result.get("formatted_phone_number")
+    )
+    if phone_number is None:
+        return None
+
+    # Get cover image URL
+    if candidate["photo_reference"]:
+        cover_image_url = f"{PLACES_API_URL}/photo?maxwidth=400&photo_reference={candidate['photo_reference']}&key={api_key}"
+    else:
+        cover_image_url = DEFAULT_COVER_IMAGE_URL
+
+    return {
+        "name": candidate["name"],
+        "address": candidate["address"],
+        "rating": candidate["rating"],
+        "user_ratings_total": candidate["user_ratings_total"],
+        "latitude": candidate["latitude"],
+        "longitude": candidate["longitude"],
+        "phone_number": phone_number,
+        "cover_image_url": cover_image_url,
+    }
+
+
+# The fields of a textsearch result that ranking and the company record need
+def place_candidate(result: dict) -> dict:
+    photos = result.get("photos", [])
+    return {
+        "place_id": result["place_id"],
+        "name": result["name"],
+        "address": result["formatted_address"],
+        "rating": result.get("rating"),
+        "user_ratings_total": result.get("user_ratings_total"),
+        "latitude": result["geometry"]["location"]["lat"],
+        "longitude": result["geometry"]["location"]["lng"],
+        "photo_reference": photos[0].get("photo_reference") if photos else None,
+    }
+
+
+# Normalizes every company's phone number and keeps the first company per number,
+# dropping any without a usable one, before anything is written or dialed
+def dedupe_by_phone(companies: list) -> list:
+    unique = {}
+    for company in companies:
+        phone_number = normalize_phone_number(company.get("phone_number"))
+        if phone_number is not None and phone_number not in unique:
+            unique[phone_number] = {**company, "phone_number": phone_number}
+    return list(unique.values())
+
+
+# Writes the discovered companies and their inquiries: one round trip each
+async def save_moving_companies(moving_query_id, companies: list):
+    company_ids = await upsert_moving_companies(companies)
+    indexed = [company for company in companies if company["phone_number"] != HARDCODED_COMPANY["phone_number"]]
+    company_index.add(indexed)
+    await bus.publish(CompaniesSaved(indexed))
+    return await create_inquiries_bulk(moving_query_id, list(company_ids.items()))
+
+
+# Geocodes both ends of a move in one batch; returns (origin, destination), each a
+# (lat, lng) or None. Only the origin is needed, so a geocoding failure for the
+# destination leaves it None instead of failing the query.
+async def geocode_moving_query(moving_query: schemas.MovingQuery):
+    origin, destination = await geocode_batch(
+        [moving_query.location_from, moving_query.location_to], os.getenv("MAPS_API_KEY"), return_exceptions=True
+    )
+    if isinstance(origin, BaseException):
+        raise origin
+    if isinstance(destination, BaseException):
+        logger.warning("destination not geocoded", extra=fields(error=repr(destination)))
+        destination = None
+    return origin, destination
+
+
+# Function that takes a city and returns the moving companies in that city. lat_long is
+# the already geocoded origin, if the caller has it; trace_parent is the span of the
+# request that created the query.
+async def get_moving_companies(moving_query: schemas.MovingQuery, moving_query_id, lat_long: tuple = None, trace_parent=None):
+    logger.info("discovering moving companies", extra=fields(moving_query_id=moving_query_id))
+    with background_tasks_in_flight.track_in_flight(task="discovery"), \
+            tracing.child_span("discovery", parent=trace_parent, moving_query_id=moving_query_id):
+        api_key = os.getenv("MAPS_API_KEY")
+        if lat_long is None:
+            with discovery_stage("geocode"):
+                lat_long = await get_lat_long(moving_query.location_from, api_key)
+        if lat_long is None:
+            raise HTTPException(status_code=400, detail="Invalid location provided")
+
+        # Companies we already know about are found locally; Places only fills thin coverage
+        with discovery_stage("local_index"):
+            nearby_companies = company_index.nearby(lat_long[0], lat_long[1], SEARCH_RADIUS_METERS, limit=DISCOVERY_LIMIT)
+        if len(nearby_companies) >= LOCAL_MIN_COMPANIES:
+            discovery_counters["local"] += 1
         else:
-            cover_image_url = "https://t4.ftcdn.net/jpg/02/30/62/35/360_F_230623592_cQY0YbsQb523d3b0yqVFupoOxIRGwtEO.jpg"
-
-        company = {
-            "name": result["name"],
-            "address": result["formatted_address"],
-            "rating": result.get("rating"),
-            "user_ratings_total": result.get("user_ratings_total"),
-            "latitude": result["geometry"]["location"]["lat"],
-            "longitude": result["geometry"]["location"]["lng"],
-            "phone_number": phone_number,
-            "cover_image_url": cover_image_url,
-        }
-        company_id = get_or_create_moving_company(company)
-        create_inquiry(moving_query_id, phone_number, company_id)
-
-        nearby_companies.append(company)
-
-    hardcoded_company = {
-        "name": "Fred Hua",
-        "address": "123 Example St, Example City, EX 12345",
-        "rating": 4.5,
-        "user_ratings_total": 100,
-        "latitude": 40.7128,  # Example latitude
-        "longitude": -74.0060,  # Example longitude
-        "phone_number": "+14157698863",
-        "cover_image_url": "https://t4.ftcdn.net/jpg/02/30/62/35/360_F_230623592_cQY0YbsQb523d3b0yqVFupoOxIRGwtEO.jpg",
+            discovery_counters["places"] += 1
+            with discovery_stage("places"):
+                nearby_companies = await find_nearby_companies(f"{lat_long[0]},{lat_long[1]}", api_key)
+        nearby_companies = dedupe_by_phone(nearby_companies + [HARDCODED_COMPANY])
+
+        with discovery_stage("save"):
+            await save_moving_companies(moving_query_id, nearby_companies)
+        return nearby_companies
+
+
+
+# Sends a prepared call to the VAPI API; the dial scheduler decides when
+async def post_vapi_call(data: dict) -> httpx.Response:
+    headers = {
+        'Authorization': f'Bearer {os.getenv("VAPI_API_KEY")}',
+        'Content-Type': 'application/json'
     }
-    company_id = get_or_create_moving_company(hardcoded_company)
-    create_inquiry(moving_query_id, hardcoded_company["phone_number"], company_id)
+    with external_call("vapi", "create_call") as call:
+        response = await clients.get("vapi").post(f"{VAPI_API_URL}/call/phone", headers=headers, json=data)
+        call.status(response.status_code, ok=(201,))
+    return response
+
+
+dialer = DialScheduler(post_vapi_call)
+call_tasks = set()
 
+Gauge("dialer_queue_depth", "VAPI calls waiting to be dialed", function=lambda: dialer._queue.qsize() if dialer._queue else 0)
+# Live calls are counted in the shared limits, so every worker reports the server's total
+Gauge("dialer_live_calls", "VAPI calls in progress", function=lambda: sum(line["live"] for line in dialer.limits.lines.values()),
+      aggregate="max")
 
 
-# Function that takes moving companies and makes a phone call to each of them
-async def create_phone_call(moving_query_id, moving_company_id, moving_company_number, items, availability, from_location, to_location):
-    moving_company_number = f"+{moving_company_number.lstrip('+').replace(' ', '')}"
-    vapi_api = os.getenv("VAPI_API_KEY")
+# Queues a single VAPI call and returns its call id, or None if VAPI rejected it (or the
+# number isn't a phone number, in which case VAPI isn't asked)
+async def place_vapi_call(moving_company_number, items, availability, from_location, to_location, priority=PRIORITY_BATCH):
+    moving_company_number = normalize_phone_number(moving_company_number)
+    if moving_company_number is None:
+        return None
     phone_id = os.getenv("VAPI_PHONE_ID")
     
     data = {
@@ -129,42 +461,95 @@ async def create_phone_call(moving_query_id, moving_company_id, moving_company_n
         },
         "phoneNumberId": phone_id
     }
-    headers = {
-        'Authorization': f'Bearer {vapi_api}',
-        'Content-Type': 'application/json'
-    }
-    
-    response = requests.post('https://api.vapi.ai/call/phone', headers=headers, json=data)
+    # VAPI echoes the metadata in the end-of-call report, which joins the webhook to this trace
+    span = tracing.current()
+    if span is not None:
+        data["assistantOverrides"]["metadata"] = {"traceparent": tracing.traceparent(span)}
+    vapi_call_id = await dialer.submit(data, priority=priority)
+    if vapi_call_id is not None:
+        logger.info("call created", extra=fields(vapi_call_id=vapi_call_id, priority=priority))
+    return vapi_call_id
 
-    if response.status_code == 201:
-        print('Call created successfully')
-        print(response.json().get("id"))
-        update_vapi_id(moving_query_id, moving_company_number, response.json().get("id"))
-        
-    else:
-        print('Failed to create call')
-        print(response.text)
-    return {"message": "List of phone calls"}
-
-# Function to make calls using the moving query
-async def make_calls(moving_query: schemas.MovingQueryCreate, moving_companies: list):
-
-    for company in moving_companies:
-        create_phone_call(
-            customer_number=company.phone_number,
-            items=moving_query.items,
-            availability=moving_query.date,
-            from_location=moving_query.location_from,
-            to_location=moving_query.location_to,
-            phone_number_id=company["phone_number"]
+
+# Calls one company of a moving query ahead of any queued batch calls. Its inquiry is
+# claimed first, as call_all does, so a company that is being called or was called isn't
+# dialed again. Returns the vapi_call_id, or None if VAPI rejected the call.
+async def create_phone_call(moving_query: dict, moving_company_number: str):
+    phone_number = normalize_phone_number(moving_company_number)
+    inquiries = [inquiry for inquiry in await get_inquiries(moving_query["id"]) if inquiry["phone_number"] == phone_number]
+    if not inquiries:
+        raise HTTPException(status_code=404, detail="Moving company has no inquiry for this moving query")
+    claimed = await claim_inquiries([inquiry["id"] for inquiry in inquiries if not inquiry.get("vapi_call_id")])
+    if not claimed:
+        raise HTTPException(status_code=409, detail="Moving company is already being called or was called")
+    await release_inquiries([inquiry["id"] for inquiry in claimed[1:]])
+    return await call_inquiry(moving_query, claimed[0], priority=PRIORITY_INTERACTIVE)
+
+# Dials one claimed inquiry and writes its vapi_call_id as soon as VAPI accepts the
+# call, so /status and the event stream show it without waiting for the other calls.
+# An inquiry whose call isn't placed is handed back for the next call_all.
+async def call_inquiry(moving_query: dict, inquiry: dict, priority: int = PRIORITY_BATCH):
+    vapi_call_id = None
+    try:
+        vapi_call_id = await place_vapi_call(
+            inquiry["phone_number"],
+            items=moving_query["items_details"],
+            availability=moving_query["availability"],
+            from_location=moving_query["location_from"],
+            to_location=moving_query["location_to"],
+            priority=priority,
         )
+        if vapi_call_id is not None:
+            await update_vapi_ids_bulk([(inquiry, vapi_call_id)])
+    finally:
+        if vapi_call_id is None:
+            await release_inquiries([inquiry["id"]])
+    return vapi_call_id
+
+# Function that queues a call to every claimed inquiry of a moving query; the dial
+# scheduler bounds how many are placed at once. Returns the (inquiry, vapi_call_id)
+# pairs VAPI accepted.
+async def make_calls(moving_query: dict, inquiries: list):
+    # One call per number, even if a number ended up on two inquiries
+    by_number = {}
+    for inquiry in inquiries:
+        by_number.setdefault(normalize_phone_number(inquiry["phone_number"]), inquiry)
+    by_number.pop(None, None)
+    dialed = {inquiry["id"] for inquiry in by_number.values()}
+    await release_inquiries([inquiry["id"] for inquiry in inquiries if inquiry["id"] not in dialed])
+    inquiries = list(by_number.values())
+    vapi_call_ids = await asyncio.gather(*(call_inquiry(moving_query, inquiry) for inquiry in inquiries))
+    return [(inquiry, vapi_call_id) for inquiry, vapi_call_id in zip(inquiries, vapi_call_ids) if vapi_call_id is not None]
+
+
+# Calls a query's claimed inquiries in the background. A call can wait in the dial queue
+# for as long as a phone call lasts (every live-call slot taken), so call_all returns
+# without waiting for it.
+def start_calls(moving_query: dict, inquiries: list, trace_parent=None):
+    async def run():
+        with background_tasks_in_flight.track_in_flight(task="calls"), \
+                tracing.child_span("calls.place", parent=trace_parent, calls=len(inquiries)):
+            await make_calls(moving_query, inquiries)
+
+    task = asyncio.create_task(run())
+    call_tasks.add(task)
+    task.add_done_callback(call_tasks.discard)
+    return task
+
+
+# Cancels calls still queued; their inquiries are released for a later call_all
+async def stop_calls():
+    tasks = list(call_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 #returns price
 async def process_phone_call(transcript : str):
     #parse transcript to get price
 
     prompt = "You are given the following transcript of a phone call with a moving company. The customer is asking for a quote for their move. The transcript is as follows: " + transcript + " Please provide the price quoted by the moving company and only the price in the form of a float."
-    url = "https://api.openai.com/v1/engines/davinci/completions"
+    url = f"{OPENAI_API_URL}/v1/engines/davinci/completions"
     headers = {
         "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
     }
@@ -173,9 +558,10 @@ async def process_phone_call(transcript : str):
         "prompt": prompt,
         "max_tokens": 50
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=data, headers=headers)
-    print(response.json())
+    with external_call("openai", "completion") as call:
+        response = await clients.get("openai").post(url, json=data, headers=headers)
+        call.status(response.status_code)
+    logger.debug("transcript price response", extra=fields(status=response.status_code, body=Sampled(response.json)))
     if response.status_code != 200:
         raise HTTPException(status_code=400, detail="Error processing your request")
 
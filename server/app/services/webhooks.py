@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import random
+from dotenv import load_dotenv
+from app.cache.cache import MISSING, TTLCache
+from app.database.database import update_finished_call
+from app.queue.sqlite_queue import SQLiteQueue
+from app.telemetry import tracing
+from app.telemetry.logs import fields
+from app.telemetry.metrics import Counter, Histogram, background_tasks_in_flight
+from app.utils import normalize_phone_number
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+WEBHOOK_JOURNAL_PATH = os.getenv("WEBHOOK_JOURNAL_PATH", "webhook_journal.db")
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+# How often the consumer looks for retries or reports journaled by other processes
+WEBHOOK_POLL_INTERVAL = 1.0
+# Finished reports are kept this long for inspection and redelivery dedupe
+WEBHOOK_RETENTION = 7 * 24 * 3600
+WEBHOOK_DEDUPE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_SIZE", "10000"))
+WEBHOOK_DEDUPE_TTL = float(os.getenv("WEBHOOK_DEDUPE_TTL", str(24 * 3600)))
+
+# End-of-call reports are journaled here by the webhook endpoint and written to the
+# database by the consumer below
+journal = SQLiteQueue(WEBHOOK_JOURNAL_PATH, "vapi_webhook")
+
+# VAPI can redeliver a report. Recently seen (call id, message type) keys are answered
+# from memory; older ones are caught by the journal's unique dedupe_key.
+seen = TTLCache(maxsize=WEBHOOK_DEDUPE_SIZE, ttl=WEBHOOK_DEDUPE_TTL)
+dedupe_counters = {"reports": 0, "memory_duplicates": 0, "journal_duplicates": 0}
+webhook_writes_total = Counter("webhook_writes_total", "End-of-call report writes by outcome", ("outcome",))
+webhook_batch_seconds = Histogram("webhook_batch_seconds", "Time to write one claimed batch of reports")
+
+_wakeup = None
+_consumer = None
+
+
+# Pulls the fields we store out of a VAPI end-of-call report. Raises KeyError/TypeError/
+# ValueError if the report is malformed.
+def parse_end_of_call_report(json_data: dict) -> dict:
+    message = json_data["message"]
+    # Normalized like the stored number, so the inquiry update matches it
+    phone_number = normalize_phone_number(message["call"]["customer"]["number"])
+    if phone_number is None:
+        raise ValueError(f"not a phone number: {message['call']['customer']['number']!r}")
+    return {
+        "vapi_call_id": message["call"]["id"],
+        "phone_number": phone_number,
+        "price": message["analysis"]["structured_data"]["price"],
+        "summary": message["analysis"]["summary"],
+        "transcript": message["transcript"],
+        "duration_minutes": message["duration_minutes"],
+        "recording_url": message["stereo_recording_url"],
+        # Set when the call was placed within a trace
+        "traceparent": ((message["call"].get("assistantOverrides") or {}).get("metadata") or {}).get("traceparent"),
+    }
+
+
+def dedupe_key(report: dict, message_type: str = "end-of-call-report") -> str:
+    return f"{report['vapi_call_id']}:{message_type}"
+
+
+# Journals a report for the consumer; returns once it is durably on disk.
+# Returns False if the report is a redelivery and was dropped.
+async def enqueue(report: dict) -> bool:
+    key = dedupe_key(report)
+    dedupe_counters["reports"] += 1
+    if seen.get(key) is not MISSING:
+        dedupe_counters["memory_duplicates"] += 1
+        return False
+
+    report_id = await asyncio.to_thread(journal.put, report, key)
+    seen.set(key, True)
+    if report_id is None:
+        dedupe_counters["journal_duplicates"] += 1
+        return False
+    if _wakeup is not None:
+        _wakeup.set()
+    return True
+
+
+async def write_report(report: dict) -> bool:
+    parent = tracing.parse_traceparent(report.get("traceparent"))
+    with tracing.child_span("quote.stored", parent=parent, vapi_call_id=report["vapi_call_id"]):
+        rows = await update_finished_call(
+            report["vapi_call_id"],
+            report["phone_number"],
+            report["price"],
+            report["summary"],
+            report["transcript"],
+            report["duration_minutes"],
+            report["recording_url"],
+        )
+    return bool(rows)
+
+
+# Writes one claimed batch. Reports whose inquiry isn't found yet (the webhook can beat
+# the vapi_call_id write) or whose write fails are retried with backoff.
+async def process_batch(batch: list):
+    with background_tasks_in_flight.track_in_flight(task="webhook_batch"), webhook_batch_seconds.time():
+        results = await asyncio.gather(*(write_report(report) for _, report, _ in batch), return_exceptions=True)
+        done = []
+        for (report_id, _, attempts), result in zip(batch, results):
+            if result is True:
+                done.append(report_id)
+                webhook_writes_total.inc(outcome="written")
+                continue
+            error = repr(result) if isinstance(result, BaseException) else "no matching inquiry"
+            if attempts >= WEBHOOK_MAX_ATTEMPTS:
+                logger.error("giving up on webhook report", extra=fields(report_id=report_id, attempts=attempts, error=error))
+                webhook_writes_total.inc(outcome="failed")
+                await asyncio.to_thread(journal.fail, report_id, error)
+            else:
+                webhook_writes_total.inc(outcome="retried")
+                await asyncio.to_thread(journal.retry, report_id, random.uniform(0, 2 ** attempts), error)
+        await asyncio.to_thread(journal.ack, done)
+
+
+async def consume():
+    while True:
+        batch = await asyncio.to_thread(journal.claim, WEBHOOK_BATCH_SIZE)
+        if batch:
+            await process_batch(batch)
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=WEBHOOK_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start():
+    global _wakeup, _consumer
+    if _consumer is not None:
+        return
+    journal.purge(WEBHOOK_RETENTION)
+    _wakeup = asyncio.Event()
+    _consumer = asyncio.create_task(consume())
+
+
+async def stop():
+    global _consumer
+    if _consumer is None:
+        return
+    _consumer.cancel()
+    await asyncio.gather(_consumer, return_exceptions=True)
+    _consumer = None
+
+
+def stats() -> dict:
+    reports = dedupe_counters["reports"]
+    duplicates = dedupe_counters["memory_duplicates"] + dedupe_counters["journal_duplicates"]
+    return {
+        "journal": journal.stats(),
+        "dedupe": {
+            **dedupe_counters,
+            "hit_rate": duplicates / reports if reports else 0.0,
+            "seen_set": seen.stats(),
+        },
+    }
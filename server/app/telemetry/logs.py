@@ -0,0 +1,143 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# JSON-lines logging. Callers hand records to a bounded in-memory queue and return; a
+# listener thread formats and writes them, so a slow stdout never stalls the event loop.
+#
+#   logger = logging.getLogger(__name__)
+#   logger.info("call placed", extra=fields(vapi_call_id=call_id, body=Lazy(response.json)))
+
+# Default level, plus per-logger overrides like "app.services.dialer=DEBUG,httpx=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# String fields longer than this are cut, so a transcript costs the same as a short note
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2048"))
+# Share of records whose Sampled() fields are kept
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+_listener = None
+_handler = None
+_traceback_formatter = logging.Formatter()
+
+
+# Structured fields for a record: logger.info("...", extra=fields(key=value))
+def fields(**values) -> dict:
+    return {"fields": values}
+
+
+# A field computed only if the record is actually emitted
+class Lazy:
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def resolve(self):
+        return self.function(*self.args)
+
+
+# A (large) field kept on a LOG_PAYLOAD_SAMPLE_RATE share of records, and only computed then
+class Sampled(Lazy):
+    def resolve(self):
+        if random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+            return "<sampled out>"
+        return super().resolve()
+
+
+def truncate(value):
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_CHARS:
+        return f"{value[:LOG_MAX_FIELD_CHARS]}...<{len(value) - LOG_MAX_FIELD_CHARS} more chars>"
+    if isinstance(value, (dict, list)):
+        return truncate(json.dumps(value, default=str))
+    return value
+
+
+# Resolves lazy fields and truncates large ones before the record is queued, then enqueues
+# it without blocking; when the queue is full the record is counted and dropped
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        values = dict(getattr(record, "fields", None) or {})
+        # The traceback goes in its own (truncated) field rather than into msg
+        if record.exc_info:
+            values["exc"] = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info, record.exc_text = None, None
+        record = super().prepare(record)
+        record.fields = {
+            key: truncate(value.resolve() if isinstance(value, Lazy) else value)
+            for key, value in values.items()
+        }
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        return json.dumps(entry, default=str)
+
+
+def parse_levels(levels: str) -> dict:
+    overrides = {}
+    for item in filter(None, (part.strip() for part in levels.split(","))):
+        name, _, level = item.partition("=")
+        overrides[name.strip()] = level.strip().upper()
+    return overrides
+
+
+# Routes the root logger through the queue; safe to call more than once
+def setup(level: str = LOG_LEVEL, levels: str = LOG_LEVELS, stream=None):
+    global _listener, _handler
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level.upper())
+    for name, logger_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(logger_level)
+    _listener.start()
+
+
+# Flushes what is queued and stops the listener thread
+def shutdown():
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+    }
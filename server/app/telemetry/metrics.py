@@ -0,0 +1,388 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from app.telemetry import tracing
+from app.telemetry.logs import fields
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# In-process counters, gauges and histograms, rendered in the Prometheus text format by
+# GET /metrics. Recording a sample is a dict lookup and an add under a lock, cheap
+# enough for every outbound call.
+#
+# With several worker processes (METRICS_PATH set; gunicorn.conf.py sets it) each process
+# also writes a snapshot of its values to a shared SQLite table every METRICS_SYNC_INTERVAL
+# seconds and at shutdown, and /metrics renders the whole server: counters and histograms
+# summed over every process that ever ran, so they never go backwards when a worker is
+# replaced, and gauges combined over the processes still reporting.
+
+METRICS_PATH = os.getenv("METRICS_PATH", "")
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", "5"))
+# A process whose snapshot is older than this is gone; its gauges no longer count
+METRICS_STALE_AFTER = 3 * METRICS_SYNC_INTERVAL
+# How long a snapshot write waits for another process's lock
+METRICS_BUSY_TIMEOUT = 1.0
+
+# Latency buckets in seconds, from cache-speed lookups to slow third-party calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = {}  # name -> metric, in registration order
+_lock = threading.Lock()
+_conn = None
+_store_lock = threading.Lock()  # not _lock: a slow write must not hold up recording
+_process = secrets.token_hex(8)  # the snapshot row of this process; a pid can be reused
+_task = None
+
+
+def _label_key(label_names: tuple, labels: dict) -> tuple:
+    return tuple(str(labels[name]) for name in label_names)
+
+
+def _render_labels(label_names: tuple, key: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(label_names, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        with _lock:
+            _metrics[name] = self
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.label_names, labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    # label key -> value
+    def samples(self) -> dict:
+        return dict(self.values)
+
+    # Sums the samples of several processes
+    def merge(self, snapshots: list, fresh: list) -> dict:
+        merged = {}
+        for samples in snapshots:
+            for key, value in samples.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, samples: dict = None) -> list:
+        lines = super().render()
+        for key, value in (self.samples() if samples is None else samples).items():
+            lines.append(f"{self.name}{_render_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+# A value that goes up and down. With function=, the value is read when rendered.
+# `aggregate` is how the values of several worker processes combine: "sum" for what each
+# process holds (its queue, its tasks), "max" for a server-wide value every process reads.
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function=None, aggregate: str = "sum"):
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.function = function
+        self.aggregate = aggregate
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self.values[_label_key(self.label_names, labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.label_names, labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    # Counts the block as in flight while it runs
+    @contextmanager
+    def track_in_flight(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> dict:
+        return {(): self.function()} if self.function is not None else dict(self.values)
+
+    # Only processes still reporting count
+    def merge(self, snapshots: list, fresh: list) -> dict:
+        merged = {}
+        for samples, is_fresh in zip(snapshots, fresh):
+            if not is_fresh:
+                continue
+            for key, value in samples.items():
+                merged[key] = value if key not in merged else (
+                    max(merged[key], value) if self.aggregate == "max" else merged[key] + value
+                )
+        return merged
+
+    def render(self, samples: dict = None) -> list:
+        lines = super().render()
+        for key, value in (self.samples() if samples is None else samples).items():
+            lines.append(f"{self.name}{_render_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.label_names, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> dict:
+        with _lock:
+            return {key: list(series) for key, series in self.series.items()}
+
+    # Adds up the bucket counts, sums and counts of several processes
+    def merge(self, snapshots: list, fresh: list) -> dict:
+        merged = {}
+        for samples in snapshots:
+            for key, series in samples.items():
+                total = merged.setdefault(key, [0] * len(series))
+                for index, value in enumerate(series):
+                    total[index] += value
+        return merged
+
+    def render(self, samples: dict = None) -> list:
+        lines = super().render()
+        for key, series in (self.samples() if samples is None else samples).items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_render_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_render_labels(self.label_names, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_render_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# This process's values as JSON: metric name -> [[label values, sample], ...]
+def _snapshot() -> str:
+    return json.dumps({
+        name: [[list(key), sample] for key, sample in metric.samples().items()]
+        for name, metric in list(_metrics.items())
+    })
+
+
+def _connect(path: str):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=METRICS_BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS metrics (
+            process TEXT PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            snapshot TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+
+def _write(snapshot: str):
+    with _store_lock:
+        _conn.execute(
+            "INSERT OR REPLACE INTO metrics (process, pid, snapshot, updated_at) VALUES (?, ?, ?, ?)",
+            (_process, os.getpid(), snapshot, time.time()),
+        )
+
+
+def _read() -> list:
+    with _store_lock:
+        return _conn.execute("SELECT snapshot, updated_at FROM metrics").fetchall()
+
+
+async def _sync():
+    try:
+        await asyncio.to_thread(_write, _snapshot())
+    except sqlite3.Error as e:
+        logger.warning("could not write metrics snapshot", extra=fields(path=METRICS_PATH, error=repr(e)))
+
+
+async def _sync_forever():
+    while True:
+        await asyncio.sleep(METRICS_SYNC_INTERVAL)
+        await _sync()
+
+
+# Starts sharing this process's metrics when METRICS_PATH is set
+def start():
+    global _conn, _task
+    if not METRICS_PATH or _task is not None:
+        return
+    if _conn is None:
+        _conn = _connect(METRICS_PATH)
+    _task = asyncio.create_task(_sync_forever())
+
+
+# Writes a last snapshot, so counters of this process keep counting after it exits
+async def stop():
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+    await _sync()
+
+
+# Every process's metrics combined, or this process's alone when they aren't shared (or
+# the shared table can't be read)
+async def render_all() -> str:
+    if _task is None:
+        return render()
+    try:
+        await asyncio.to_thread(_write, _snapshot())
+        rows = await asyncio.to_thread(_read)
+    except sqlite3.Error as e:
+        logger.warning("could not read metrics snapshots", extra=fields(path=METRICS_PATH, error=repr(e)))
+        return render()
+    now = time.time()
+    snapshots = [json.loads(snapshot) for snapshot, _ in rows]
+    fresh = [updated_at > now - METRICS_STALE_AFTER for _, updated_at in rows]
+    lines = []
+    for name, metric in list(_metrics.items()):
+        samples = [
+            {tuple(key): sample for key, sample in snapshot.get(name, [])}
+            for snapshot in snapshots
+        ]
+        lines.extend(metric.render(metric.merge(samples, fresh)))
+    return "\n".join(lines) + "\n"
+
+
+# Every call to an external dependency (Google, VAPI, OpenAI, the database) is recorded
+# here, labelled by dependency and operation
+external_request_seconds = Histogram(
+    "external_request_seconds", "Latency of calls to external dependencies", ("dependency", "operation"),
+)
+external_requests_total = Counter(
+    "external_requests_total", "Calls to external dependencies by outcome", ("dependency", "operation", "outcome"),
+)
+
+
+class ExternalCall:
+    def __init__(self):
+        self.outcome = "ok"
+
+    # Marks the call failed when the response status isn't the expected one(s)
+    def status(self, status_code: int, ok=range(200, 300)):
+        if status_code not in ok:
+            self.outcome = "error"
+
+
+# Work running outside a request (discovery, webhook batches), by task
+background_tasks_in_flight = Gauge("background_tasks_in_flight", "Background tasks currently running", ("task",))
+
+
+# Times one external call, as a span too when it is part of a trace. Exceptions count as
+# errors (cancellations separately); use call.status() for HTTP responses that came back but failed:
+#
+#   with external_call("google_places", "details") as call:
+#       response = await client.get(...)
+#       call.status(response.status_code)
+@contextmanager
+def external_call(dependency: str, operation: str):
+    call = ExternalCall()
+    start = time.perf_counter()
+    with tracing.child_span(f"{dependency}.{operation}") as span:
+        try:
+            yield call
+        except asyncio.CancelledError:
+            call.outcome = "cancelled"
+            raise
+        except BaseException:
+            call.outcome = "error"
+            raise
+        finally:
+            external_request_seconds.observe(time.perf_counter() - start, dependency=dependency, operation=operation)
+            external_requests_total.inc(dependency=dependency, operation=operation, outcome=call.outcome)
+            if span is not None:
+                span.set(outcome=call.outcome)
+                if call.outcome == "error":
+                    span.status = "error"
+
+
+# Wraps an object so every coroutine method call is timed as an external call
+class Instrumented:
+    def __init__(self, target, dependency: str):
+        self._target = target
+        self._dependency = dependency
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def timed(*args, **kwargs):
+            with external_call(self._dependency, name):
+                return await attribute(*args, **kwargs)
+        return timed
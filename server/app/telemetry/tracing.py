@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import NamedTuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Spans for the hops of a moving query: the request, background discovery, each dial and
+# the webhook that reports the quote minutes later. The trace id is stored on the moving
+# query and travels to VAPI (and back in the webhook) as a W3C traceparent, so every hop
+# lands in the same trace.
+#
+#   with tracing.span("moving_query.create") as root:
+#       ...
+#   with tracing.child_span("discovery", parent=root):
+#       ...
+#
+# Finished spans are kept in memory (see get_trace) and, with TRACE_EXPORT_PATH set,
+# appended to that file as OTLP JSON lines, one ExportTraceServiceRequest per span. Each
+# line goes to the file in a single O_APPEND write as the span ends, so a killed worker
+# loses nothing already finished and workers sharing the file never split a line.
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "robocaller-server")
+
+_current = ContextVar("span", default=None)
+_finished = deque(maxlen=TRACE_BUFFER_SIZE)
+_lock = threading.Lock()
+_export_fd = None
+counters = {"started": 0, "exported": 0}
+
+
+# Enough of a span to parent another one, e.g. parsed from a traceparent
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start = time.time()
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_seconds": self.end - self.start,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def current():
+    return _current.get()
+
+
+# W3C traceparent header value for a span ("00-<trace id>-<span id>-01")
+def traceparent(span) -> str:
+    return f"00-{span.trace_id}-{span.span_id}-01"
+
+
+def parse_traceparent(value: str):
+    parts = value.split("-") if isinstance(value, str) else ()
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return SpanContext(parts[1], parts[2])
+
+
+# Runs the block in a new span, the child of parent (default: the current span). With
+# neither a parent nor a trace_id, the span starts a new trace.
+@contextmanager
+def span(name: str, parent=None, trace_id: str = None, **attributes):
+    parent = parent or current()
+    if parent is not None:
+        trace_id = parent.trace_id
+    new = Span(name, trace_id or new_trace_id(), parent.span_id if parent is not None else None, attributes)
+    counters["started"] += 1
+    token = _current.set(new)
+    try:
+        yield new
+    except asyncio.CancelledError:
+        new.status = "cancelled"
+        raise
+    except BaseException as e:
+        new.status = "error"
+        new.attributes.setdefault("error", repr(e))
+        raise
+    finally:
+        _current.reset(token)
+        new.end = time.time()
+        export(new)
+
+
+# A span only if there is a trace to join; untraced work (startup, tests) stays untraced
+def child_span(name: str, parent=None, **attributes):
+    parent = parent or current()
+    if parent is None:
+        return nullcontext()
+    return span(name, parent=parent, **attributes)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(span: Span) -> dict:
+    otlp_span = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(int(span.start * 1e9)),
+        "endTimeUnixNano": str(int(span.end * 1e9)),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": {"ok": 1, "error": 2}.get(span.status, 0)},
+    }
+    if span.parent_id:
+        otlp_span["parentSpanId"] = span.parent_id
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [otlp_span]}],
+    }]}
+
+
+def export(span: Span):
+    global _export_fd
+    with _lock:
+        _finished.append(span)
+        counters["exported"] += 1
+        if not TRACE_EXPORT_PATH:
+            return
+        if _export_fd is None:
+            _export_fd = os.open(TRACE_EXPORT_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(_export_fd, (json.dumps(to_otlp(span), default=str) + "\n").encode("utf-8"))
+
+
+# Closes the export file
+def shutdown():
+    global _export_fd
+    with _lock:
+        if _export_fd is not None:
+            os.close(_export_fd)
+            _export_fd = None
+
+
+# The spans of one trace still in memory, in start order, with time totals per span name.
+# Only this process's spans: under several workers the rest of the trace (the dials, the
+# webhook) may have ended in another one; the export file has every worker's.
+def get_trace(trace_id: str) -> dict:
+    with _lock:
+        spans = sorted((span for span in _finished if span.trace_id == trace_id), key=lambda span: span.start)
+    by_name = {}
+    for span in spans:
+        totals = by_name.setdefault(span.name, {"count": 0, "seconds": 0.0})
+        totals["count"] += 1
+        totals["seconds"] += span.end - span.start
+    return {
+        "trace_id": trace_id,
+        "duration_seconds": max(span.end for span in spans) - spans[0].start if spans else 0.0,
+        "by_name": by_name,
+        "spans": [span.to_dict() for span in spans],
+    }
+
+
+def stats() -> dict:
+    return {**counters, "buffered": len(_finished), "export_path": TRACE_EXPORT_PATH or None}
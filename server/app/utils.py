@@ -1,25 +1,117 @@
-import requests
+import asyncio
+import logging
+import os
+from functools import lru_cache
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from app.cache.cache import MISSING, SQLiteCache, TieredCache, TTLCache
+from app.clients.clients import clients
+from app.telemetry.logs import fields
+from app.telemetry.metrics import external_call
 
-async def get_lat_long(address, api_key):
-    # Construct the URL for the Google Maps Geocoding API
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?address={address}&key={api_key}"
-    
-    # Make a request to the API
-    response = requests.get(url)
-    
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON response
-        data = response.json()
-        
-        # Check if the response contains results
-        if data['results']:
-            # Extract latitude and longitude
-            location = data['results'][0]['geometry']['location']
-            return f"{location['lat']},{location['lng']}"
-        else:
-            return None
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+GEOCODE_API_URL = os.getenv("GEOCODE_API_URL", "https://maps.googleapis.com/maps/api/geocode/json")
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")
+
+# Geocodes barely change, so positive results live for 30 days; "no such address" for one
+geocode_cache = TieredCache(
+    memory=TTLCache(maxsize=int(os.getenv("GEOCODE_CACHE_SIZE", "1024"))),
+    disk=SQLiteCache(CACHE_DB_PATH, "geocode_cache"),
+    ttl=float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600))),
+    negative_ttl=float(os.getenv("GEOCODE_NEGATIVE_TTL", str(24 * 3600))),
+)
+
+# Google couldn't geocode for reasons that aren't the address's fault (an outage, quota,
+# a rejected key). 503 when it's worth retrying shortly, 502 otherwise; the job
+# workers retry both.
+class GeocodingUnavailable(HTTPException):
+    def __init__(self, reason: str):
+        status_code = 503 if reason == "OVER_QUERY_LIMIT" else 502
+        super().__init__(status_code=status_code, detail=f"Geocoding service unavailable: {reason}")
+        self.reason = reason
+
+
+# Punctuation and spacing people put in phone numbers, removed in one translate pass
+_PHONE_PUNCTUATION = str.maketrans("", "", " ()-./\t\u00a0")
+
+
+# The one phone number format used everywhere: E.164 ("+14155550100"). Numbers without a
+# country code are taken as North American. Returns None if it can't be a phone number.
+# Discovery, dialing and webhook matching all go through here so stored, dialed and
+# reported numbers compare equal.
+@lru_cache(maxsize=4096)
+def normalize_phone_number(number: str):
+    if not number:
+        return None
+    number = number.lower().split("ext", 1)[0].split("x", 1)[0].translate(_PHONE_PUNCTUATION)
+    if number.startswith("+"):
+        digits = number[1:]
+    elif number.startswith("00"):
+        digits = number[2:]
+    elif len(number) == 10:
+        digits = "1" + number
+    elif len(number) == 11 and number.startswith("1"):
+        digits = number
     else:
-        # Handle errors
-        print(f"Error: {response.status_code}")
-        return None, None
+        return None
+    if not (digits.isascii() and digits.isdigit()) or not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+# "  New York,  NY " and "new york ny" share one cache entry
+def normalize_address(address: str) -> str:
+    return " ".join(address.lower().replace(",", " ").split())
+
+
+# Returns (lat, lng) for an address, or None if Google found no such address. Raises
+# GeocodingUnavailable when Google couldn't answer.
+async def get_lat_long(address, api_key):
+    key = normalize_address(address)
+    cached = await geocode_cache.aget(key)
+    if cached is not MISSING:
+        return tuple(cached) if cached is not None else None
+
+    try:
+        with external_call("google_geocode", "geocode") as call:
+            response = await clients.get("google").get(GEOCODE_API_URL, params={"address": address, "key": api_key})
+            call.status(response.status_code)
+    except httpx.HTTPError as e:
+        logger.warning("geocoding failed", extra=fields(error=repr(e)))
+        raise GeocodingUnavailable(type(e).__name__)
+    if response.status_code != 200:
+        # Transient failures are not cached
+        logger.warning("geocoding failed", extra=fields(status=response.status_code))
+        raise GeocodingUnavailable(f"HTTP {response.status_code}")
+
+    data = response.json()
+    if data.get("results"):
+        location = data["results"][0]["geometry"]["location"]
+        lat_long = (location["lat"], location["lng"])
+        await geocode_cache.aset(key, list(lat_long))
+        return lat_long
+
+    # Only a definite "no such address" is the caller's fault, and only it is cached;
+    # quota and key errors are not
+    if data.get("status") == "ZERO_RESULTS":
+        await geocode_cache.aset(key, None)
+        return None
+    logger.warning("geocoding failed", extra=fields(status=data.get("status")))
+    raise GeocodingUnavailable(data.get("status") or "no results")
+
+
+# Geocodes several addresses at once and returns their (lat, lng) or None, in order.
+# Addresses that normalize alike are looked up once, cached ones not at all, and the
+# rest concurrently. With return_exceptions, a lookup that raised returns its exception.
+async def geocode_batch(addresses: list, api_key, return_exceptions: bool = False) -> list:
+    unique = {}
+    for address in addresses:
+        unique.setdefault(normalize_address(address), address)
+    results = await asyncio.gather(
+        *(get_lat_long(address, api_key) for address in unique.values()), return_exceptions=return_exceptions
+    )
+    by_key = dict(zip(unique, results))
+    return [by_key[normalize_address(address)] for address in addresses]
@@ -0,0 +1,68 @@
+# Drives the dial scheduler against a local fake VAPI server that rate-limits some requests.
+#
+#   python -m benchmarks.bench_dialer
+#
+# Checks that the call rate stays under the token bucket, that live calls never exceed the
+# per-phone cap, and that 429s are retried until every call is placed.
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.stubs import StubServer, create_vapi_app
+
+PORT = int(os.getenv("STUB_VAPI_PORT", "8766"))
+CALLS = 40
+CALLS_PER_SECOND = 10
+BURST = 5
+MAX_LIVE_CALLS = 8
+CALL_DURATION = 0.5  # seconds until the fake end-of-call report frees the line
+
+os.environ["VAPI_API_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "stub.stub.stub")
+
+from app.services import services  # noqa: E402  (reads VAPI_API_URL at import)
+from app.services.dialer import DialScheduler, PRIORITY_INTERACTIVE  # noqa: E402
+from app.clients.clients import clients  # noqa: E402
+
+
+async def main(vapi_app):
+    dialer = DialScheduler(services.post_vapi_call, workers=8, calls_per_second=CALLS_PER_SECOND,
+                           burst=BURST, max_live_calls=MAX_LIVE_CALLS, max_attempts=6,
+                           limits_path=os.path.join(tempfile.mkdtemp(), "dialer.db"))
+    live = 0
+    max_live = 0
+
+    async def call(i):
+        nonlocal live, max_live
+        payload = {"phoneNumberId": "stub-line", "customer": {"number": f"+1415555{i:04d}"}}
+        vapi_call_id = await dialer.submit(payload, priority=PRIORITY_INTERACTIVE if i % 10 == 0 else 10)
+        live += 1
+        max_live = max(max_live, live)
+        await asyncio.sleep(CALL_DURATION)
+        live -= 1
+        await dialer.call_ended(vapi_call_id)
+        return vapi_call_id
+
+    start = time.perf_counter()
+    vapi_call_ids = await asyncio.gather(*(call(i) for i in range(CALLS)))
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0)
+    stats = dialer.stats()
+    await dialer.stop()
+    await clients.close()
+
+    placed = vapi_app.state.calls
+    window = placed[-1][0] - placed[0][0]
+    print(f"{CALLS} calls placed in {elapsed:.2f}s, {sum(1 for v in vapi_call_ids if v)} succeeded")
+    print(f"observed rate after burst: {(len(placed) - BURST) / window:.1f}/s (limit {CALLS_PER_SECOND}/s)")
+    print(f"max live calls: {max_live} (limit {MAX_LIVE_CALLS})")
+    print(f"fake VAPI saw {vapi_app.state.requests} requests, {stats['retried']} retried after 429")
+    print(f"queue wait p50 {stats['wait_seconds']['p50']:.2f}s, p95 {stats['wait_seconds']['p95']:.2f}s, max {stats['wait_seconds']['max']:.2f}s")
+
+
+if __name__ == "__main__":
+    vapi_app = create_vapi_app(latency=0.05, rate_limit_every=7)
+    with StubServer(vapi_app, PORT):
+        asyncio.run(main(vapi_app))
@@ -0,0 +1,50 @@
+# Compares sequential vs concurrent Places Details lookups against a local stub Places server.
+#
+#   python -m benchmarks.bench_places_pipeline
+#
+# With concurrency=1 the discovery latency is the sum of the Details round trips; fanned out
+# it should drop to roughly the slowest single round trip plus the textsearch.
+import asyncio
+import os
+import time
+
+from benchmarks.stubs import StubServer, create_places_app
+
+PORT = int(os.getenv("STUB_PLACES_PORT", "8765"))
+SEARCH_DELAY = 0.05
+DETAILS_DELAY = 0.05
+RESULT_COUNTS = (5, 10, 20)
+REPEATS = 3
+
+os.environ["PLACES_API_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "stub.stub.stub")
+
+from app.services import services  # noqa: E402  (reads PLACES_API_URL at import)
+from app.clients.clients import clients  # noqa: E402
+
+
+async def time_discovery(result_count: int, concurrency: int) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        companies = await services.find_nearby_companies("40.7128,-74.0060", "stub", limit=result_count, concurrency=concurrency, use_cache=False)
+        best = min(best, time.perf_counter() - start)
+        assert len(companies) == result_count
+    return best
+
+
+async def main():
+    print(f"textsearch {SEARCH_DELAY * 1000:.0f} ms, details {DETAILS_DELAY * 1000:.0f} ms per round trip")
+    print(f"{'N':>4} {'sequential':>12} {'concurrent':>12} {'speedup':>8}")
+    for result_count in RESULT_COUNTS:
+        sequential = await time_discovery(result_count, concurrency=1)
+        concurrent = await time_discovery(result_count, concurrency=result_count)
+        print(f"{result_count:>4} {sequential * 1000:>10.1f}ms {concurrent * 1000:>10.1f}ms {sequential / concurrent:>7.1f}x")
+    await clients.close()
+
+
+if __name__ == "__main__":
+    app = create_places_app(result_count=max(RESULT_COUNTS), search_delay=SEARCH_DELAY, details_delay=DETAILS_DELAY)
+    with StubServer(app, PORT):
+        asyncio.run(main())
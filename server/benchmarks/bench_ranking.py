@@ -0,0 +1,83 @@
+# Times the candidate ranking stage (haversine + Bayesian score + top-K) for growing
+# candidate counts, against the same ranking written as a plain Python loop.
+#
+#   python -m benchmarks.bench_ranking
+#
+# No servers are needed; the candidates are random companies around New York.
+import math
+import random
+import time
+
+import numpy as np
+
+from app.services.ranking import (
+    RANKING_DISTANCE_WEIGHT, RANKING_PRIOR_RATING, RANKING_PRIOR_REVIEWS, haversine_meters, rank_companies, score, top_k,
+)
+
+ORIGIN = (40.7128, -74.0060)
+RADIUS = 80467
+TOP_K = 5
+CANDIDATE_COUNTS = (100, 1000, 10000, 100000)
+
+
+def random_companies(count: int) -> list:
+    random.seed(count)
+    return [
+        {
+            "latitude": ORIGIN[0] + random.uniform(-1, 1),
+            "longitude": ORIGIN[1] + random.uniform(-1, 1),
+            "rating": round(random.uniform(1, 5), 1),
+            "user_ratings_total": random.randint(0, 2000),
+        }
+        for _ in range(count)
+    ]
+
+
+def rank_python(lat: float, lng: float, companies: list, radius: float, k: int) -> list:
+    scored = []
+    for company in companies:
+        lat2, lng2 = math.radians(company["latitude"]), math.radians(company["longitude"])
+        a = math.sin((lat2 - math.radians(lat)) / 2) ** 2 + math.cos(math.radians(lat)) * math.cos(lat2) * math.sin((lng2 - math.radians(lng)) / 2) ** 2
+        distance = 2 * 6371008.8 * math.asin(math.sqrt(a))
+        if distance > radius:
+            continue
+        reviews = company["user_ratings_total"]
+        rating = (RANKING_PRIOR_REVIEWS * RANKING_PRIOR_RATING + company["rating"] * reviews) / (RANKING_PRIOR_REVIEWS + reviews)
+        scored.append(((1 - RANKING_DISTANCE_WEIGHT) * rating / 5 + RANKING_DISTANCE_WEIGHT * (1 - distance / radius), company))
+    scored.sort(key=lambda pair: -pair[0])
+    return [company for _, company in scored[:k]]
+
+
+# The array stage alone, as the spatial index runs it on columns it already holds
+def rank_arrays(lat: float, lng: float, lats, lngs, ratings, review_counts, radius: float, k: int):
+    distances = haversine_meters(lat, lng, lats, lngs)
+    inside = np.flatnonzero(distances <= radius)
+    return inside[top_k(score(distances[inside], ratings[inside], review_counts[inside], radius), k)]
+
+
+def best_time(function, *args, repeats: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"top {TOP_K} within {RADIUS / 1000:.0f} km")
+    print("numpy = rank_companies on dicts, arrays = the NumPy stage on prebuilt columns")
+    print(f"{'N':>7} {'numpy':>10} {'arrays':>10} {'python':>10} {'speedup':>8}")
+    for count in CANDIDATE_COUNTS:
+        companies = random_companies(count)
+        assert rank_companies(*ORIGIN, companies, RADIUS, TOP_K) == rank_python(*ORIGIN, companies, RADIUS, TOP_K)
+        columns = [np.array([company[field] for company in companies], dtype=float)
+                   for field in ("latitude", "longitude", "rating", "user_ratings_total")]
+        vectorized = best_time(rank_companies, *ORIGIN, companies, RADIUS, TOP_K)
+        arrays = best_time(rank_arrays, *ORIGIN, *columns, RADIUS, TOP_K)
+        python = best_time(rank_python, *ORIGIN, companies, RADIUS, TOP_K)
+        print(f"{count:>7} {vectorized * 1000:>8.2f}ms {arrays * 1000:>8.2f}ms {python * 1000:>8.2f}ms {python / vectorized:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
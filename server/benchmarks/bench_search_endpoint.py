@@ -0,0 +1,94 @@
+# Load-tests POST /get_moving_companies/ end to end with no external services: the app runs
+# in its own uvicorn process on the SQLAlchemy storage backend with a throwaway SQLite file,
+# and talks to the stub Google Maps server in another process.
+#
+#   python -m benchmarks.bench_search_endpoint
+#
+# Reports requests per second and POST latency at increasing client concurrency, then how
+# long the discovery jobs those requests queued take to finish. Discovery runs as durable
+# jobs on the app's in-process job workers (JOB_WORKERS, default 4), which share the CPU and
+# the single SQLite connection with the request handler; each level starts with an empty
+# job queue. Past about 16 concurrent requests the handlers' inserts queue behind that one
+# connection, so req/s falls and p99 climbs, and at 64 the discovery jobs of the level's
+# own requests roughly halve req/s again. Set BENCH_JOB_WORKERS=0 to time the request
+# handler alone (discovery then never runs and the drain column stays at zero).
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stubs import ServerProcess
+
+MAPS_PORT = int(os.getenv("STUB_PLACES_PORT", "8765"))
+APP_PORT = int(os.getenv("BENCH_APP_PORT", "8767"))
+REQUESTS = 200
+JOB_WORKERS = os.getenv("BENCH_JOB_WORKERS", "4")
+CONCURRENCY_LEVELS = (1, 4, 16, 64)
+
+SEARCH = {
+    "location_from": "New York, NY",
+    "location_to": "Boston, MA",
+    "created_at": "2025-04-01T12:00:00",
+    "items": "1 bedroom",
+    "items_details": "bed, couch, 10 boxes",
+    "availability": "next Monday",
+    "user_id": "bench",
+}
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def search():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/get_moving_companies/", json=SEARCH)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(search() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return REQUESTS / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+# Waits until the job workers have finished every discovery job queued so far
+async def drain_jobs(client: httpx.AsyncClient):
+    start = time.perf_counter()
+    while True:
+        queue = (await client.get("/stats")).json()["jobs"]["queue"]
+        if not queue["pending"] and not queue["processing"]:
+            return time.perf_counter() - start
+        await asyncio.sleep(0.1)
+
+
+async def main():
+    limits = httpx.Limits(max_connections=max(CONCURRENCY_LEVELS))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", limits=limits, timeout=30) as client:
+        print(f"{'concurrency':>11} {'req/s':>8} {'p50':>9} {'p99':>9} {'drain':>8}")
+        for concurrency in CONCURRENCY_LEVELS:
+            rate, p50, p99 = await run_level(client, concurrency)
+            drain = await drain_jobs(client) if JOB_WORKERS != "0" else 0
+            print(f"{concurrency:>11} {rate:>8.0f} {p50 * 1000:>7.1f}ms {p99 * 1000:>7.1f}ms {drain:>7.1f}s")
+
+
+if __name__ == "__main__":
+    workdir = tempfile.mkdtemp()
+    app_env = {
+        "STORAGE_BACKEND": "sqlalchemy",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir}/bench.db",
+        "CACHE_DB_PATH": f"{workdir}/cache.db",
+        "JOBS_PATH": f"{workdir}/jobs.db",
+        "WEBHOOK_JOURNAL_PATH": f"{workdir}/webhook_journal.db",
+        "JOB_WORKERS": JOB_WORKERS,
+        "PLACES_API_URL": f"http://127.0.0.1:{MAPS_PORT}",
+        "GEOCODE_API_URL": f"http://127.0.0.1:{MAPS_PORT}/geocode/json",
+    }
+    maps = ServerProcess(["benchmarks.stubs", "places", "--port", str(MAPS_PORT), "--result-count", "5"], MAPS_PORT)
+    server = ServerProcess(["uvicorn", "app.main:app", "--port", str(APP_PORT), "--log-level", "warning"], APP_PORT, env=app_env)
+    with maps, server:
+        asyncio.run(main())
@@ -0,0 +1,153 @@
+# Local stand-ins for the external APIs the server talks to, used by the benchmarks
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+
+# Google Maps stub: geocode and textsearch take search_delay seconds and textsearch returns
+# result_count places in pages of page_size (next_page_token is "<location>:<offset>");
+# details takes details_delay seconds and every phoneless_every-th place has no phone number
+def create_places_app(result_count: int = 20, search_delay: float = 0.05, details_delay: float = 0.05,
+                      page_size: int = 20, phoneless_every: int = 0) -> FastAPI:
+    app = FastAPI()
+    app.state.details_requests = 0
+    app.state.textsearch_requests = 0
+
+    @app.get("/textsearch/json")
+    async def textsearch(query: str = "", location: str = "", radius: int = 0, key: str = "", pagetoken: str = ""):
+        await asyncio.sleep(search_delay)
+        app.state.textsearch_requests += 1
+        offset = 0
+        if pagetoken:
+            location, offset = pagetoken.rsplit(":", 1)
+            offset = int(offset)
+        lat, lng = (float(value) for value in location.split(",")) if location else (0.0, 0.0)
+        end = min(offset + page_size, result_count)
+        body = {
+            "status": "OK",
+            "results": [
+                {
+                    "place_id": f"stub-{i}",
+                    "name": f"Stub Movers {i}",
+                    "formatted_address": f"{i} Stub St, Example City",
+                    "rating": 4.0 + (i % 10) / 10,
+                    "user_ratings_total": 10 * (i + 1),
+                    "geometry": {"location": {"lat": lat + i * 0.001, "lng": lng - i * 0.001}},
+                }
+                for i in range(offset, end)
+            ],
+        }
+        if end < result_count:
+            body["next_page_token"] = f"{location}:{end}"
+        return body
+
+    @app.get("/geocode/json")
+    async def geocode(address: str, key: str = ""):
+        await asyncio.sleep(search_delay)
+        return {"status": "OK", "results": [{"geometry": {"location": {"lat": 40.7128, "lng": -74.0060}}}]}
+
+    @app.get("/details/json")
+    async def details(place_id: str, key: str = ""):
+        await asyncio.sleep(details_delay)
+        app.state.details_requests += 1
+        index = int(place_id.rsplit("-", 1)[-1])
+        if phoneless_every and index % phoneless_every == 0:
+            return {"status": "OK", "result": {}}
+        return {"status": "OK", "result": {"formatted_phone_number": f"(415) 555-{index:04d}"}}
+
+    return app
+
+
+# Runs an ASGI app on a background thread for the duration of a with-block
+class StubServer:
+    def __init__(self, app: FastAPI, port: int, host: str = "127.0.0.1"):
+        self.url = f"http://{host}:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+# Fake VAPI call API: every `rate_limit_every`-th request gets a 429, the rest create a call.
+# app.state.calls records (timestamp, customer number) for each created call.
+def create_vapi_app(latency: float = 0.05, rate_limit_every: int = 0) -> FastAPI:
+    app = FastAPI()
+    app.state.calls = []
+    app.state.requests = 0
+    app.state.in_flight = 0
+    app.state.max_in_flight = 0
+
+    @app.post("/call/phone", status_code=201)
+    async def create_call(body: dict):
+        app.state.requests += 1
+        app.state.in_flight += 1
+        app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+        try:
+            await asyncio.sleep(latency)
+            if rate_limit_every and app.state.requests % rate_limit_every == 0:
+                return JSONResponse({"message": "Too Many Requests"}, status_code=429, headers={"Retry-After": "0.2"})
+            app.state.calls.append((time.monotonic(), body["customer"]["number"]))
+            return {"id": str(uuid.uuid4()), "status": "queued"}
+        finally:
+            app.state.in_flight -= 1
+
+    return app
+
+
+# Starts `python -m <module args>` in a subprocess and waits until it accepts connections on port
+class ServerProcess:
+    def __init__(self, args: list, port: int, env: dict = None, host: str = "127.0.0.1"):
+        self.url = f"http://{host}:{port}"
+        self.args = [sys.executable, "-m", *args]
+        self.port = port
+        self.host = host
+        self.env = {**os.environ, **(env or {})}
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.args, env=self.env, stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((self.host, self.port), timeout=0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.process.kill()
+        raise RuntimeError(f"{' '.join(self.args)} did not start listening on port {self.port}")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub API server")
+    parser.add_argument("api", choices=["places", "vapi"])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--result-count", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05)
+    options = parser.parse_args()
+    if options.api == "places":
+        stub_app = create_places_app(options.result_count, search_delay=options.delay, details_delay=options.delay)
+    else:
+        stub_app = create_vapi_app(latency=options.delay)
+    uvicorn.run(stub_app, host="127.0.0.1", port=options.port, log_level="warning")
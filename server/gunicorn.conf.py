@@ -0,0 +1,62 @@
+import math
+import multiprocessing
+import os
+
+# Production entrypoint: gunicorn supervising uvicorn worker processes.
+#
+#   gunicorn app.main:app -c gunicorn.conf.py
+#
+# Each worker is a full copy of the app with its own event loop. What they share lives in
+# SQLite files next to the app: the geocode and Places caches (CACHE_DB_PATH), the job and
+# webhook queues, the VAPI rate and live-call limits (VAPI_LIMITS_PATH), the event relay
+# that carries inquiry events between workers, and the metrics /metrics adds up
+# (METRICS_PATH).
+
+
+# The cgroup CPU quota as (quota, period) microseconds, or None if there is no limit:
+# cpu.max on cgroup v2, cpu.cfs_quota_us / cpu.cfs_period_us on v1 (-1 is no limit)
+def cgroup_cpu_quota():
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else (int(quota), int(period))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else (quota, period)
+    except (OSError, ValueError):
+        return None
+
+
+# CPUs this container may use: the cgroup quota if there is one (Kubernetes CPU limits),
+# else the CPUs the process can run on
+def available_cpus() -> int:
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        return max(math.ceil(quota[0] / quota[1]), 1)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+# Async workers don't block on I/O, so one per CPU keeps every core busy
+workers = int(os.getenv("WEB_CONCURRENCY") or available_cpus())
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Workers import the app after the fork: the SQLite connections and HTTP clients the
+# modules open at import must not be shared between processes
+preload_app = False
+
+# The relay and the shared metrics are only needed when there is more than one worker
+if workers > 1:
+    os.environ.setdefault("EVENT_RELAY_PATH", "events.db")
+    os.environ.setdefault("METRICS_PATH", "metrics.db")